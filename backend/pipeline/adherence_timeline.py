@@ -0,0 +1,164 @@
+from datetime import date, timedelta
+from itertools import accumulate
+from typing import List, Optional
+
+from local_summary import SLOTS
+
+# ===============================
+# CONFIG
+# ===============================
+STATUSES = ["taken", "delayed", "missed"]
+
+# Logs with a time outside SLOTS still count towards totals
+_SLOT_INDEX = {slot: i for i, slot in enumerate(SLOTS)}
+_OTHER_SLOT = len(SLOTS)
+_STATUS_INDEX = {status: i for i, status in enumerate(STATUSES)}
+_COLUMNS = (len(SLOTS) + 1) * len(STATUSES)
+
+# Priority when several medicines share a slot: missed > delayed > taken > pending
+_SLOT_PRIORITY = ["pending", "taken", "delayed", "missed"]
+
+# Longest window one request may ask for (10 years of days)
+MAX_RANGE_DAYS = 3660
+
+GRANULARITIES = ("day", "week", "month")
+
+
+def parse_day(value) -> Optional[date]:
+    """'2026-01-19' (or an ISO timestamp) as a date, None if unparseable"""
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except (TypeError, ValueError):
+        return None
+
+
+def _column(slot: int, status: int) -> int:
+    return slot * len(STATUSES) + status
+
+
+# ===============================
+# PREFIX-SUM INDEX
+# ===============================
+class AdherenceIndex:
+    """
+    One patient's dose logs as cumulative per-day counts.
+
+    Building is O(days + logs); afterwards the taken/delayed/missed counts
+    of any window inside [start, end], overall or per slot, are the
+    difference of two prefix rows - O(1) whatever the window length.
+    """
+
+    def __init__(self, logs, start: date, end: date):
+        if end < start:
+            raise ValueError("end date is before start date")
+        if (end - start).days + 1 > MAX_RANGE_DAYS:
+            raise ValueError(f"date range is longer than {MAX_RANGE_DAYS} days")
+
+        self.start = start
+        self.end = end
+        days = (end - start).days + 1
+
+        daily = [[0] * _COLUMNS for _ in range(days)]
+        self._slot_status = [[0] * len(SLOTS) for _ in range(days)]
+        self.skipped = 0
+
+        for log in logs:
+            status = _STATUS_INDEX.get(log.status)
+            day = parse_day(log.date)
+            if status is None or day is None or not start <= day <= end:
+                self.skipped += 1
+                continue
+            offset = (day - start).days
+            slot = _SLOT_INDEX.get(log.time, _OTHER_SLOT)
+            daily[offset][_column(slot, status)] += 1
+            if slot != _OTHER_SLOT:
+                # status index + 1 is its rank in _SLOT_PRIORITY
+                row = self._slot_status[offset]
+                row[slot] = max(row[slot], status + 1)
+
+        # _prefix[i][c] = count in column c over the first i days
+        zero = [0] * _COLUMNS
+        self._prefix = [zero] + list(
+            accumulate(daily, lambda acc, row: [a + b for a, b in zip(acc, row)])
+        )
+
+    # ---------- range queries ----------
+    def _offsets(self, start: date, end: date):
+        start = max(start, self.start)
+        end = min(end, self.end)
+        return (start - self.start).days, (end - self.start).days + 1
+
+    def counts(self, start: date, end: date, slot: Optional[str] = None) -> dict:
+        """Status counts and adherence for [start, end], optionally one slot"""
+        lo, hi = self._offsets(start, end)
+        totals = dict.fromkeys(STATUSES, 0)
+        if lo < hi:
+            before, after = self._prefix[lo], self._prefix[hi]
+            slots = [_SLOT_INDEX[slot]] if slot else range(len(SLOTS) + 1)
+            for s in slots:
+                for status, i in _STATUS_INDEX.items():
+                    column = _column(s, i)
+                    totals[status] += after[column] - before[column]
+
+        total = sum(totals.values())
+        return {
+            **totals,
+            "total": total,
+            "adherence": round(totals["taken"] / total * 100) if total else None
+        }
+
+    def day_slots(self, day: date) -> dict:
+        """Aggregated status of each slot on one day"""
+        offset = (day - self.start).days
+        if not 0 <= offset < len(self._slot_status):
+            return dict.fromkeys(SLOTS, "pending")
+        row = self._slot_status[offset]
+        return {slot: _SLOT_PRIORITY[row[i]] for i, slot in enumerate(SLOTS)}
+
+    # ---------- timeline ----------
+    def timeline(self, start: date, end: date, granularity: str = "day") -> List[dict]:
+        """
+        Timeline entries for [start, end].
+
+        "day" entries keep the original shape ({"date": "Jan 19", "morning":
+        "taken", ...}); "week" (Mon-Sun) and "month" entries carry counts,
+        adherence and per-slot adherence for the bucket, clipped to the window.
+        """
+        if granularity == "day":
+            return [
+                {"date": day.strftime("%b %d"), "day": day.isoformat(), **self.day_slots(day)}
+                for day in _days(start, end)
+            ]
+
+        entries = []
+        for bucket_start, bucket_end in _buckets(start, end, granularity):
+            label = bucket_start.strftime("%b %Y" if granularity == "month" else "%b %d")
+            entries.append({
+                "date": label,
+                "start": bucket_start.isoformat(),
+                "end": bucket_end.isoformat(),
+                **self.counts(bucket_start, bucket_end),
+                "slots": {
+                    slot: self.counts(bucket_start, bucket_end, slot)["adherence"] for slot in SLOTS
+                }
+            })
+        return entries
+
+
+def _days(start: date, end: date):
+    for offset in range((end - start).days + 1):
+        yield start + timedelta(days=offset)
+
+
+def _buckets(start: date, end: date, granularity: str):
+    """(first, last) day of each calendar week/month overlapping [start, end]"""
+    current = start
+    while current <= end:
+        if granularity == "week":
+            last = current + timedelta(days=6 - current.weekday())
+        else:
+            next_month = date(current.year + current.month // 12, current.month % 12 + 1, 1)
+            last = next_month - timedelta(days=1)
+        last = min(last, end)
+        yield current, last
+        current = last + timedelta(days=1)
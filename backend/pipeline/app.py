@@ -1,15 +1,28 @@
 import os
-import json
-from typing import List
-from datetime import datetime, timedelta
+import time
+from typing import List, Optional, Literal
+from datetime import date, timedelta
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 import uvicorn
 
 from dotenv import load_dotenv
 from groq import Groq
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, ValidationError, model_validator
+
+from adherence_timeline import AdherenceIndex, parse_day, MAX_RANGE_DAYS
+from cohort_analytics import rank_at_risk, COHORT_MAX_DAYS
+from dose_schedule import course_start, missed_unlogged
+from llm_scheduler import LLMScheduler, INTERACTIVE
+from local_summary import generate_local_summary, is_simple_history
+from model_router import ModelRouter, score_summary
+from prompt_compiler import PromptTemplate, CompiledPrompt, fit_list, log_usage
+from resilience import Upstream, CircuitBreaker, UpstreamUnavailable
+from response_encoding import FastJSONResponse, CompressionMiddleware
+from shared_cache import SharedCache, cache_key
 
 # ===============================
 # LOAD ENV
@@ -22,16 +35,54 @@ if not GROQ_API_KEY:
 
 # Initialize Groq client
 try:
-    groq_client = Groq(api_key=GROQ_API_KEY)
+    # Retries are handled by the resilience layer, not the SDK
+    groq_client = Groq(api_key=GROQ_API_KEY, timeout=15.0, max_retries=0)
     print("✅ Groq client initialized")
 except Exception as e:
     print(f"❌ ERROR: Groq initialization failed. Install: pip install groq")
     raise e
 
+# Uvicorn worker processes; all workers on a host share the SQLite cache
+WORKERS = int(os.getenv("WORKERS", "1"))
+
+# GROQ_RPM/GROQ_TPM are the quota of the whole Groq key, which the adherence
+# and voice servers share. Each takes its own fraction of it - ADHERENCE_GROQ_SHARE
+# here, VOICE_GROQ_SHARE (audio_to_json_pipeline.py) there; keep the two summing to
+# at most 1 - and splits that evenly across its worker processes.
+GROQ_RPM = int(os.getenv("GROQ_RPM", "30"))
+GROQ_TPM = int(os.getenv("GROQ_TPM", "6000"))
+GROQ_SHARE = float(os.getenv("ADHERENCE_GROQ_SHARE", "0.5"))
+groq_scheduler = LLMScheduler(
+    "groq", GROQ_RPM * GROQ_SHARE / WORKERS, GROQ_TPM * GROQ_SHARE / WORKERS
+)
+
+# Summaries are idempotent, so slow calls get a hedged duplicate
+groq_upstream = Upstream(
+    "groq",
+    timeout=15.0,
+    retries=2,
+    hedge=True,
+    breaker=CircuitBreaker(failure_threshold=5, reset_timeout=30.0),
+    scheduler=groq_scheduler,
+)
+
+# Short histories go to the 8B model, long/many-medicine ones to the 70B model
+summary_router = ModelRouter(
+    "adherence-summary",
+    fast_model="llama-3.1-8b-instant",
+    heavy_model="llama-3.3-70b-versatile",
+)
+
+# Identical prompts (same patient data) reuse one summary across workers
+summary_cache = SharedCache("summary", ttl=6 * 3600)
+
 # ===============================
 # FASTAPI APP
 # ===============================
-app = FastAPI(title="MediBuddy Medication Adherence Server")
+app = FastAPI(
+    title="MediBuddy Medication Adherence Server",
+    default_response_class=FastJSONResponse
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -48,6 +99,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# brotli/gzip for large timeline/cohort responses, when the client accepts it
+app.add_middleware(CompressionMiddleware)
+
 # ===============================
 # DATA MODELS
 # ===============================
@@ -55,6 +109,16 @@ class Medicine(BaseModel):
     id: str
     name: str
     schedule: List[str]
+    isCritical: bool = False
+    # Extracted schedule; medicines with a frequency get unlogged doses counted as missed
+    frequency: Optional[Literal["Daily", "Alternate Days", "Specific Days"]] = None
+    startDay: Optional[str] = None
+    days: List[str] = []
+    intakeTimes: List[str] = []
+    customTimes: List[str] = []
+    durationDays: Optional[int] = None
+    startDate: Optional[str] = None  # ISO date the course started
+    createdAt: Optional[str] = None  # set by the Node backend; the course starts that day
 
 class Log(BaseModel):
     date: str
@@ -66,96 +130,210 @@ class AdherenceRequest(BaseModel):
     patientId: str
     medicines: List[Medicine]
     logs: List[Log]
+    # "local" = templated summary, "llm" = Groq, "auto" = local for simple histories
+    summaryMode: Literal["auto", "local", "llm"] = "auto"
+    # Bulk report jobs send "batch" so they queue behind requests someone is waiting on
+    priority: Literal["interactive", "batch"] = INTERACTIVE
+    # Timeline window (ISO dates, inclusive); defaults to the last 7 days
+    startDate: Optional[str] = None
+    endDate: Optional[str] = None
+    granularity: Literal["day", "week", "month"] = "day"
+
+class PatientRecord(BaseModel):
+    patientId: str
+    medicines: List[Medicine]
+    logs: List[Log] = []
+
+class LogColumns(BaseModel):
+    """Every log of a cohort as parallel arrays; `patient` indexes CohortRequest.patients"""
+    patient: List[int]
+    date: List[str]
+    medicine: List[str]
+    time: List[str]
+    status: List[str]
+
+    @model_validator(mode="after")
+    def same_length(self):
+        lengths = {len(self.patient), len(self.date), len(self.medicine), len(self.time), len(self.status)}
+        if len(lengths) > 1:
+            raise ValueError("log columns must all have the same length")
+        return self
+
+class CohortRequest(BaseModel):
+    patients: List[PatientRecord]
+    # Columnar logs for large cohorts; when set, per-patient logs are ignored
+    logs: Optional[LogColumns] = None
+    endDate: Optional[str] = None  # ISO date, defaults to today
+    days: int = Field(90, ge=14, le=COHORT_MAX_DAYS)
+    topK: int = Field(20, ge=1, le=500)
 
 # ===============================
 # HEALTH CHECK
 # ===============================
 @app.get("/health")
 def health_check():
-    return {"status": "ok", "message": "Server is running", "ai_provider": "groq"}
+    return {
+        "status": "ok",
+        "message": "Server is running",
+        "ai_provider": "groq",
+        "upstreams": {"groq": groq_upstream.snapshot()},
+        "scheduler": {"groq": groq_scheduler.snapshot()},
+        "routing": {"summary": summary_router.snapshot()},
+        "cache": summary_cache.snapshot()
+    }
 
 # ===============================
 # AI GENERATION
 # ===============================
-def generate_summary(prompt: str) -> str:
-    """Generate summary using Groq API"""
-    try:
-        response = groq_client.chat.completions.create(
-            model="llama-3.1-8b-instant",  # Fast and efficient
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a medical adherence analyst. Provide brief, clinical summaries in 2-3 sentences."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
+# Static instructions go in the system message so the provider can reuse
+# the cached prefix; only the compact per-patient data changes per call.
+SUMMARY_PROMPT = PromptTemplate(
+    "adherence-summary",
+    """
+You are a medical adherence analyst. Provide brief, clinical summaries in 2-3 sentences.
+
+Analyze the medication adherence data in the user message and provide a brief,
+professional summary about the patient's adherence pattern. Mention any concerning trends.
+
+Data format:
+- Doses: scheduled doses - scheduled doses never logged count as missed -
+  with taken/delayed/missed counts and overall adherence
+- Medicines: one "name: adherence%" per line, lowest adherence first
+- Recent: the patient's last logged doses, one "date slot medicine status" per line, oldest first
+""",
+    budget_tokens=600,
+)
+
+MEDICINE_BUDGET_TOKENS = 300
+
+
+def build_summary_prompt(payload: AdherenceRequest, logs: List[Log], medicine_data: List[dict]) -> CompiledPrompt:
+    """Compile the summary prompt with the medicine list trimmed to budget"""
+    total_taken = sum(1 for log in logs if log.status == "taken")
+    total_missed = sum(1 for log in logs if log.status == "missed")
+    total_delayed = sum(1 for log in logs if log.status == "delayed")
+    total_logs = len(logs)
+    overall_adherence = round((total_taken / total_logs * 100) if total_logs > 0 else 0)
+
+    ranked = sorted(medicine_data, key=lambda m: m["adherence"])
+    medicine_lines, truncated = fit_list(
+        ranked,
+        MEDICINE_BUDGET_TOKENS,
+        render=lambda m: f"{m['name']}: {m['adherence']}%",
+        summarize_rest=lambda rest: (
+            f"+{len(rest)} more, avg {round(sum(m['adherence'] for m in rest) / len(rest))}%"
+        ),
+    )
+
+    # Real logs only; the inferred misses are appended per medicine, not by date
+    recent = [f"{log.date} {log.time} {log.medicine} {log.status}" for log in payload.logs[-5:]]
+    never_logged = total_logs - len(payload.logs)
+
+    prompt = SUMMARY_PROMPT.compile([
+        ("Doses", f"{total_logs} scheduled ({never_logged} never logged), {total_taken} taken "
+                  f"({overall_adherence}%), {total_delayed} delayed, {total_missed} missed; "
+                  f"{len(payload.medicines)} medications"),
+        ("Medicines", "\n".join(medicine_lines)),
+        ("Recent", "\n".join(recent)),
+    ])
+    prompt.truncated = prompt.truncated or truncated
+    return prompt
+
+
+def _valid_summary(summary: str) -> bool:
+    """A usable summary is a few sentences of plain text"""
+    if not summary or len(summary) < 40 or len(summary) > 1200:
+        return False
+    sentences = [s for s in summary.replace("!", ".").replace("?", ".").split(".") if s.strip()]
+    return 1 <= len(sentences) <= 5 and not summary.lstrip().startswith(("{", "[", "```"))
+
+
+SUMMARY_MAX_TOKENS = 200
+
+
+def generate_summary(prompt: CompiledPrompt, complexity: float = 0.0,
+                     priority: str = INTERACTIVE) -> Optional[str]:
+    """Generate summary using Groq API, None if the provider is unavailable"""
+    def call(model_name: str) -> str:
+        response = groq_upstream.call(
+            groq_client.chat.completions.create,
+            model=model_name,
+            messages=prompt.messages(),
             temperature=0.2,
-            max_tokens=200
+            max_tokens=SUMMARY_MAX_TOKENS,
+            priority=priority,
+            est_tokens=prompt.total_tokens + SUMMARY_MAX_TOKENS
         )
-        
+        log_usage(prompt.name, response)
         return response.choices[0].message.content.strip()
+
+    try:
+        prompt.log()
+        return summary_router.run(complexity, call, _valid_summary)
         
+    except UpstreamUnavailable as e:
+        print(f"⚠️ {e}")
+        return None
     except Exception as e:
         print(f"⚠️ Groq API error: {e}")
-        return "Unable to generate AI summary at this time."
+        return None
 
 # ===============================
 # HELPER FUNCTIONS
 # ===============================
-def calculate_timeline_data(logs: List[Log], last_7_days: List[str]):
-    """Calculate timeline data from logs"""
-    timeline = []
+def resolve_window(payload: AdherenceRequest):
+    """Requested (start, end) dates; 400 on bad or oversized ranges"""
+    end = parse_day(payload.endDate) if payload.endDate else date.today()
+    if end is None:
+        raise HTTPException(status_code=400, detail="endDate must be YYYY-MM-DD")
+    start = parse_day(payload.startDate) if payload.startDate else end - timedelta(days=6)
+    if start is None:
+        raise HTTPException(status_code=400, detail="startDate must be YYYY-MM-DD")
+    if start > end:
+        raise HTTPException(status_code=400, detail="startDate is after endDate")
+    if (end - start).days + 1 > MAX_RANGE_DAYS:
+        raise HTTPException(status_code=400, detail=f"Date range is limited to {MAX_RANGE_DAYS} days")
+    return start, end
+
+def calculate_timeline_data(logs: List[Log], start: date, end: date, granularity: str = "day"):
+    """Calculate timeline data and window totals from logs"""
+    # The index also covers the last 7 days, which the local summary trend reads
+    index = AdherenceIndex(logs, min(start, end - timedelta(days=6)), end)
+    timeline = index.timeline(start, end, granularity)
+    window = {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "granularity": granularity,
+        **index.counts(start, end)
+    }
     
-    print(f"📅 Processing timeline for days: {last_7_days}")
-    print(f"📝 Available log dates: {[log.date for log in logs]}")
+    print(f"📅 Timeline {window['start']} → {window['end']} by {granularity}: "
+          f"{len(timeline)} entries, {window['total']} doses ({index.skipped} logs outside window)")
     
-    for day in last_7_days:
-        # Convert "Jan 19" to "2026-01-19" format for matching
-        try:
-            day_obj = datetime.strptime(f"{day} 2026", "%b %d %Y")
-        except:
-            # Fallback if date parsing fails
-            day_obj = datetime.now()
-        
-        day_str = day_obj.strftime("%Y-%m-%d")
-        
-        day_logs = [log for log in logs if log.date == day_str]
-        
-        print(f"  {day} ({day_str}): {len(day_logs)} logs")
-        
-        # Aggregate statuses for each time slot - if ANY medicine was taken/missed/delayed
-        morning_logs = [log for log in day_logs if log.time == "morning"]
-        afternoon_logs = [log for log in day_logs if log.time == "afternoon"]
-        night_logs = [log for log in day_logs if log.time == "night"]
-        
-        # Priority: missed > delayed > taken > pending
-        def get_slot_status(slot_logs):
-            if not slot_logs:
-                return "pending"
-            statuses = [log.status for log in slot_logs]
-            if "missed" in statuses:
-                return "missed"
-            if "delayed" in statuses:
-                return "delayed"
-            if "taken" in statuses:
-                return "taken"
-            return "pending"
-        
-        morning = get_slot_status(morning_logs)
-        afternoon = get_slot_status(afternoon_logs)
-        night = get_slot_status(night_logs)
-        
-        timeline.append({
-            "date": day,
-            "morning": morning,
-            "afternoon": afternoon,
-            "night": night
-        })
-    
-    return timeline
+    return index, timeline, window
+
+def add_unlogged_doses(payload: AdherenceRequest, end: date) -> List[Log]:
+    """
+    Logs plus a "missed" entry for each scheduled dose never logged, from
+    the start of each course up to yesterday.
+
+    Medicine adherence and the summary are computed over all of the
+    patient's logs, so misses are inferred over whole courses too, not
+    just the requested window.
+    """
+    # Today's doses may still be taken, so they are not counted yet
+    cutoff = min(end, date.today() - timedelta(days=1))
+    known = [course_start(m) for m in payload.medicines] + [parse_day(log.date) for log in payload.logs]
+    known = [day for day in known if day is not None]
+    if not known:
+        return payload.logs
+    start = max(min(known), cutoff - timedelta(days=MAX_RANGE_DAYS - 1))
+    unlogged = [
+        Log(**entry) for entry in missed_unlogged(payload.medicines, payload.logs, start, cutoff)
+    ]
+    if unlogged:
+        print(f"🗓️  {len(unlogged)} scheduled doses were never logged, counting as missed")
+    return payload.logs + unlogged
 
 def calculate_medicine_adherence(medicines: List[Medicine], logs: List[Log]):
     """Calculate adherence percentage for each medicine"""
@@ -187,6 +365,10 @@ def calculate_medicine_adherence(medicines: List[Medicine], logs: List[Log]):
     
     return medicine_data
 
+def fallback_summary(payload: AdherenceRequest) -> str:
+    """Plain summary used when the AI provider is unavailable"""
+    return f"Patient {payload.patientId} has {len(payload.medicines)} medications with {len(payload.logs)} logged doses."
+
 # ===============================
 # ADHERENCE ANALYSIS API
 # ===============================
@@ -198,56 +380,81 @@ async def analyze_adherence(payload: AdherenceRequest):
     print(f"📝 Logs: {len(payload.logs)}")
     print("=" * 50)
     
+    start, end = resolve_window(payload)
+    logs = payload.logs
+    
     try:
-        # Generate last 7 days
-        today = datetime.now()
-        last_7_days = [(today - timedelta(days=i)).strftime("%b %d") for i in range(6, -1, -1)]
-        
         # 🔹 CALCULATE DATA LOCALLY
         print("📊 Calculating timeline and adherence data...")
-        timeline_data = calculate_timeline_data(payload.logs, last_7_days)
-        medicine_data = calculate_medicine_adherence(payload.medicines, payload.logs)
+        logs = add_unlogged_doses(payload, end)
+        unlogged_doses = len(logs) - len(payload.logs)
+        index, timeline_data, window = calculate_timeline_data(
+            logs, start, end, payload.granularity
+        )
+        # Trend wording in the local summary is about the past week
+        recent_days = index.timeline(end - timedelta(days=6), end)
+        medicine_data = calculate_medicine_adherence(payload.medicines, logs)
         
         print(f"✅ Calculated {len(timeline_data)} timeline entries")
         print(f"✅ Calculated {len(medicine_data)} medicine adherence scores")
         
-        # 🔹 GENERATE SUMMARY WITH GROQ
-        print("🤖 Generating summary with Groq...")
-        
-        # Calculate overall stats for summary
-        total_taken = sum(1 for log in payload.logs if log.status == "taken")
-        total_missed = sum(1 for log in payload.logs if log.status == "missed")
-        total_delayed = sum(1 for log in payload.logs if log.status == "delayed")
-        total_logs = len(payload.logs)
+        # 🔹 CHOOSE SUMMARY ENGINE
+        use_local = payload.summaryMode == "local" or (
+            payload.summaryMode == "auto"
+            and is_simple_history(payload.medicines, logs, medicine_data)
+        )
         
-        overall_adherence = round((total_taken / total_logs * 100) if total_logs > 0 else 0)
+        if use_local:
+            print("📝 Generating local summary...")
+            summary = generate_local_summary(
+                payload.medicines, logs, recent_days, medicine_data
+            )
+            print(f"✅ Summary generated: {summary[:100]}...")
+            return {
+                "summary": summary,
+                "summarySource": "local",
+                "timelineData": timeline_data,
+                "medicineData": medicine_data,
+                "window": window,
+                "unloggedDoses": unlogged_doses
+            }
         
-        summary_prompt = f"""Analyze this medication adherence data and provide a brief clinical summary (2-3 sentences):
-
-Patient ID: {payload.patientId}
-Total Medications: {len(payload.medicines)}
-Total Logged Doses: {total_logs}
-- Taken: {total_taken} ({overall_adherence}%)
-- Delayed: {total_delayed}
-- Missed: {total_missed}
-
-Individual Medicine Adherence:
-{json.dumps(medicine_data, indent=2)}
-
-Recent Activity (last 5 entries):
-{json.dumps([{"date": log.date, "medicine": log.medicine, "time": log.time, "status": log.status} for log in payload.logs[-5:]], indent=2)}
-
-Provide a brief, professional summary about the patient's adherence pattern. Mention any concerning trends."""
+        # 🔹 GENERATE SUMMARY WITH GROQ
+        print("🤖 Generating summary with Groq...")
         
-        summary = generate_summary(summary_prompt)
+        summary_prompt = build_summary_prompt(payload, logs, medicine_data)
+        complexity = score_summary(len(payload.medicines), len(logs))
+        key = cache_key(summary_prompt.prefix, summary_prompt.dynamic, summary_router.choose(complexity))
+        try:
+            # Wait for a slot here, not in a worker thread: a batch backlog
+            # must not use up the threadpool interactive calls and /health need
+            async with groq_scheduler.slot(payload.priority):
+                summary = await run_in_threadpool(
+                    summary_cache.get_or_compute, key,
+                    lambda: generate_summary(summary_prompt, complexity, payload.priority)
+                )
+        except UpstreamUnavailable as e:
+            print(f"⚠️ {e}")
+            summary = None
+        summary_source = "llm"
         
-        print(f"✅ Summary generated: {summary[:100]}...")
+        if summary is None:
+            print("⚠️ AI summary unavailable, using local summary")
+            summary = generate_local_summary(
+                payload.medicines, logs, recent_days, medicine_data
+            )
+            summary_source = "local"
+        else:
+            print(f"✅ Summary generated: {summary[:100]}...")
         
         # 🔹 RETURN COMPLETE RESULT
         result = {
             "summary": summary,
+            "summarySource": summary_source,
             "timelineData": timeline_data,
-            "medicineData": medicine_data
+            "medicineData": medicine_data,
+            "window": window,
+            "unloggedDoses": unlogged_doses
         }
         
         print("✅ Response ready")
@@ -260,18 +467,60 @@ Provide a brief, professional summary about the patient's adherence pattern. Men
         print("⚠️ Falling back to manual calculation only")
         
         try:
-            timeline_data = calculate_timeline_data(payload.logs, last_7_days)
-            medicine_data = calculate_medicine_adherence(payload.medicines, payload.logs)
+            _, timeline_data, window = calculate_timeline_data(
+                logs, start, end, payload.granularity
+            )
+            medicine_data = calculate_medicine_adherence(payload.medicines, logs)
         except:
             timeline_data = []
             medicine_data = []
+            window = None
         
         return {
-            "summary": f"Patient {payload.patientId} has {len(payload.medicines)} medications with {len(payload.logs)} logged doses.",
+            "summary": fallback_summary(payload),
+            "summarySource": "fallback",
             "timelineData": timeline_data,
-            "medicineData": medicine_data
+            "medicineData": medicine_data,
+            "window": window
         }
 
+# ===============================
+# COHORT ANALYTICS API
+# ===============================
+@app.post("/cohort/at-risk")
+async def cohort_at_risk(request: Request):
+    """
+    Rank a doctor's patients by adherence risk (no LLM call).
+
+    Body: a CohortRequest. Large cohorts should send `logs` as parallel
+    arrays - the body is parsed and validated straight from JSON by
+    pydantic-core, with no model object per log.
+    """
+    body = await request.body()
+    started = time.perf_counter()
+    try:
+        payload = await run_in_threadpool(CohortRequest.model_validate_json, body)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors(include_url=False))
+    parse_ms = (time.perf_counter() - started) * 1000
+
+    end = parse_day(payload.endDate) if payload.endDate else date.today()
+    if end is None:
+        raise HTTPException(status_code=400, detail="endDate must be YYYY-MM-DD")
+    
+    print(f"👥 Cohort request: {len(payload.patients)} patients, {payload.days} days, top {payload.topK}")
+    
+    # CPU-bound; keep it off the event loop
+    result = await run_in_threadpool(
+        rank_at_risk, payload.patients, end, payload.days, payload.topK, payload.logs
+    )
+    result["timings"] = {"parse_ms": round(parse_ms, 1), **result["timings"]}
+    
+    print(f"✅ Ranked {result['cohort']['patients']} patients "
+          f"({result['cohort']['logs']} logs) in "
+          f"{sum(result['timings'].values()):.0f}ms")
+    return result
+
 # ===============================
 # RUN SERVER
 # ===============================
@@ -282,15 +531,18 @@ if __name__ == "__main__":
     print("📍 URL: http://localhost:5003")
     print("🎯 Endpoints:")
     print("   - POST /analyze-adherence")
+    print("   - POST /cohort/at-risk")
     print("   - GET  /health")
     print("=" * 60)
-    print("🤖 AI Provider: Groq (llama-3.1-8b-instant)")
+    print("🤖 AI Provider: Groq (llama-3.1-8b-instant / llama-3.3-70b-versatile)")
     print("⚠️  Make sure GROQ_API_KEY is set in .env file")
     print("=" * 60)
 
+    # Import string so uvicorn can start WORKERS processes
     uvicorn.run(
-        app,
+        "app:app",
         host="0.0.0.0",
         port=5003,
+        workers=WORKERS,
         log_level="info"
     )
@@ -1,21 +1,37 @@
 import os
+import re
 import sys
 import time
+import asyncio
 import json
-import subprocess
-import shutil
+import uuid
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional, Tuple
 
 from fastapi import FastAPI, File, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 import uvicorn
 
 from dotenv import load_dotenv
 from groq import Groq
 import requests
 
+from executors import SubprocessRunner
+from llm_scheduler import LLMScheduler
+from model_router import ModelRouter, score_transcript
+from prompt_compiler import PromptTemplate, log_usage
+from resilience import Upstream, CircuitBreaker, UpstreamUnavailable
+from response_encoding import FastJSONResponse, CompressionMiddleware
+from shared_cache import SharedCache, cache_key, file_key
+from upload_ingest import (
+    ingest_upload,
+    BodySizeLimitMiddleware,
+    UploadSniffMiddleware,
+    AUDIO_KINDS,
+    MULTIPART_OVERHEAD,
+)
+
 # ===============================
 # LOAD ENV
 # ===============================
@@ -31,7 +47,8 @@ if not GROQ_API_KEY:
 
 # Initialize Groq client
 try:
-    groq_client = Groq(api_key=GROQ_API_KEY)
+    # Retries are handled by the resilience layer, not the SDK
+    groq_client = Groq(api_key=GROQ_API_KEY, timeout=20.0, max_retries=0)
 except Exception as e:
     print(f"ERROR: Groq initialization failed. Install latest groq + httpx", file=sys.stderr)
     raise e
@@ -42,10 +59,74 @@ HEADERS = {
     "content-type": "application/json"
 }
 
+# (connect, read) timeouts for every AssemblyAI request
+ASSEMBLYAI_TIMEOUT = (5, 60)
+TRANSCRIPTION_DEADLINE = 180  # seconds to wait for a transcript job
+POLL_INTERVAL = 3
+
+# ===============================
+# UPSTREAMS
+# ===============================
+# Uvicorn worker processes; all workers on a host share the SQLite cache
+WORKERS = int(os.getenv("WORKERS", "1"))
+
+# GROQ_RPM/GROQ_TPM are the quota of the whole Groq key, which the adherence
+# and voice servers share. Each takes its own fraction of it - VOICE_GROQ_SHARE
+# here, ADHERENCE_GROQ_SHARE (app.py) there; keep the two summing to
+# at most 1 - and splits that evenly across its worker processes.
+GROQ_RPM = int(os.getenv("GROQ_RPM", "30"))
+GROQ_TPM = int(os.getenv("GROQ_TPM", "6000"))
+GROQ_SHARE = float(os.getenv("VOICE_GROQ_SHARE", "0.5"))
+groq_scheduler = LLMScheduler(
+    "groq", GROQ_RPM * GROQ_SHARE / WORKERS, GROQ_TPM * GROQ_SHARE / WORKERS
+)
+
+# Extraction prompts are idempotent, so slow calls get a hedged duplicate
+groq_upstream = Upstream(
+    "groq",
+    timeout=20.0,
+    retries=2,
+    hedge=True,
+    breaker=CircuitBreaker(failure_threshold=5, reset_timeout=30.0),
+    scheduler=groq_scheduler,
+)
+
+# Creating upload/transcript resources is not idempotent - retry only, no hedging
+assemblyai_upstream = Upstream(
+    "assemblyai",
+    timeout=90.0,
+    retries=2,
+    breaker=CircuitBreaker(failure_threshold=5, reset_timeout=60.0),
+)
+
+# Upload limits - voice notes are short, anything past this is rejected
+MAX_AUDIO_SIZE = 25 * 1024 * 1024  # 25MB
+MAX_AUDIO_SECONDS = 300            # 5 minutes
+
+# Short dictations go to the 8B model, long multi-medicine ones to the 70B model
+extraction_router = ModelRouter(
+    "voice-extraction",
+    fast_model="llama-3.1-8b-instant",
+    heavy_model="llama-3.3-70b-versatile",
+)
+
+# ffmpeg/ffprobe run as asyncio subprocesses so conversions never block
+# the event loop; beyond the queue limit requests get a 429
+ffmpeg_runner = SubprocessRunner("ffmpeg", max_queue=8, timeout=120.0)
+
+# Re-sent recordings (client retries, duplicate taps) skip AssemblyAI and Groq.
+# Transcripts are keyed by the uploaded bytes, not the encoded file - Ogg
+# streams get a random serial number, so re-encoding never hashes the same.
+transcript_cache = SharedCache("transcript", ttl=24 * 3600)
+medication_cache = SharedCache("voice-medication", ttl=24 * 3600)
+
 # ===============================
 # FASTAPI APP
 # ===============================
-app = FastAPI(title="MediBuddy Voice Processing Server")
+app = FastAPI(
+    title="MediBuddy Voice Processing Server",
+    default_response_class=FastJSONResponse
+)
 
 # Enable CORS for Flutter app
 app.add_middleware(
@@ -56,6 +137,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Reject oversized bodies while they stream in, before multipart buffering
+app.add_middleware(BodySizeLimitMiddleware, max_bytes=MAX_AUDIO_SIZE + MULTIPART_OVERHEAD)
+
+# 415 for disguised files as soon as their first bytes arrive
+app.add_middleware(UploadSniffMiddleware, path_kinds={"/api/medicine/process-voice": AUDIO_KINDS})
+
+# brotli/gzip for large JSON responses, when the client accepts it
+app.add_middleware(CompressionMiddleware)
+
 # Create necessary directories
 os.makedirs("uploads", exist_ok=True)
 os.makedirs("input", exist_ok=True)
@@ -65,40 +155,138 @@ os.makedirs("output", exist_ok=True)
 # HELPER FUNCTIONS
 # ===============================
 
-def convert_to_wav(input_file: str) -> str:
-    """Convert audio to WAV format"""
-    base = os.path.splitext(os.path.basename(input_file))[0]
-    wav_path = os.path.join("input", f"{base}.wav")
-
+async def probe_duration(input_file: str) -> Optional[float]:
+    """Read the container duration in seconds with ffprobe (None if unknown)"""
     cmd = [
-        "ffmpeg", "-y",
-        "-i", input_file,
-        "-ac", "1",
-        "-ar", "16000",
-        "-c:a", "pcm_s16le",
-        "-vn",
-        "-hide_banner",
-        "-loglevel", "error",
-        wav_path
+        "ffprobe",
+        "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        input_file
     ]
 
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    if result.returncode != 0:
-        raise RuntimeError(f"FFmpeg error: {result.stderr.decode()}")
+    returncode, stdout, stderr = await ffmpeg_runner.run(cmd)
+    if returncode != 0:
+        raise RuntimeError(f"FFprobe error: {stderr.decode()}")
 
-    return wav_path
+    try:
+        return float(stdout.decode().strip())
+    except ValueError:
+        return None
 
 
-def upload_audio(path: str) -> str:
-    """Upload audio to AssemblyAI"""
+# ===============================
+# AUDIO PREPROCESSING
+# ===============================
+# Energy-based voice activity detection: anything quieter than this for
+# longer than SILENCE_MIN_SECONDS at either end of the clip is trimmed.
+SILENCE_THRESHOLD_DB = -45
+SILENCE_MIN_SECONDS = 0.3
+MIN_SPEECH_SECONDS = 0.3
+
+# Tried in order; Opus is ~10x smaller than PCM WAV for speech, FLAC is the
+# lossless fallback for ffmpeg builds without libopus. Both are accepted
+# by AssemblyAI.
+UPLOAD_CODECS = [
+    ("ogg", ["-c:a", "libopus", "-b:a", "24k", "-application", "voip"]),
+    ("flac", ["-c:a", "flac", "-compression_level", "8"]),
+]
+
+_TRIM_EDGE = (
+    f"silenceremove=start_periods=1:start_duration={SILENCE_MIN_SECONDS}"
+    f":start_threshold={SILENCE_THRESHOLD_DB}dB"
+)
+# Trim the leading edge, reverse, trim again (the old trailing edge), reverse back
+SILENCE_FILTER = f"{_TRIM_EDGE},areverse,{_TRIM_EDGE},areverse"
+
+
+async def preprocess_audio(input_file: str, seconds_in: Optional[float] = None) -> dict:
+    """
+    Trim leading/trailing silence, cap the duration and encode compactly.
+
+    Pass `seconds_in` when the input was already probed; it is only
+    probed here when omitted.
+
+    Returns:
+        dict with "path" of the encoded file plus "codec", "bytes_in",
+        "bytes_out", "seconds_in", "seconds_out" and "elapsed_ms".
+
+    Raises:
+        HTTPException: 422 if the recording has no audible speech.
+    """
+    start = time.perf_counter()
+    base = os.path.splitext(os.path.basename(input_file))[0]
+    last_error = ""
+    if seconds_in is None:
+        seconds_in = await probe_duration(input_file)
+
+    for extension, codec_args in UPLOAD_CODECS:
+        out_path = os.path.join("input", f"{base}.{extension}")
+        cmd = [
+            "ffmpeg", "-y",
+            "-i", input_file,
+            "-vn",
+            "-ac", "1",
+            "-ar", "16000",
+            "-af", SILENCE_FILTER,
+            "-t", str(MAX_AUDIO_SECONDS),
+            *codec_args,
+            "-hide_banner",
+            "-loglevel", "error",
+            out_path
+        ]
+
+        returncode, _, stderr = await ffmpeg_runner.run(cmd)
+        if returncode == 0:
+            break
+        last_error = stderr.decode()
+        if os.path.exists(out_path):
+            os.remove(out_path)
+    else:
+        raise RuntimeError(f"FFmpeg error: {last_error}")
+
+    seconds_out = await probe_duration(out_path) or 0.0
+    if seconds_out < MIN_SPEECH_SECONDS:
+        os.remove(out_path)
+        raise HTTPException(status_code=422, detail="No speech detected in the recording.")
+
+    return {
+        "path": out_path,
+        "codec": extension,
+        "bytes_in": os.path.getsize(input_file),
+        "bytes_out": os.path.getsize(out_path),
+        "seconds_in": seconds_in,
+        "seconds_out": seconds_out,
+        "elapsed_ms": (time.perf_counter() - start) * 1000,
+    }
+
+
+def _post_upload(path: str) -> dict:
     with open(path, "rb") as f:
         r = requests.post(
             "https://api.assemblyai.com/v2/upload",
             headers=UPLOAD_HEADERS,
-            data=f
+            data=f,
+            timeout=ASSEMBLYAI_TIMEOUT
         )
     r.raise_for_status()
-    return r.json()["upload_url"]
+    return r.json()
+
+
+def upload_audio(path: str) -> str:
+    """Upload audio to AssemblyAI"""
+    return assemblyai_upstream.call(_post_upload, path)["upload_url"]
+
+
+def _post_transcript(payload: dict) -> dict:
+    r = requests.post(
+        "https://api.assemblyai.com/v2/transcript",
+        headers=HEADERS,
+        json=payload,
+        timeout=ASSEMBLYAI_TIMEOUT
+    )
+    r.raise_for_status()
+    return r.json()
 
 
 def start_transcription(audio_url: str) -> str:
@@ -107,24 +295,24 @@ def start_transcription(audio_url: str) -> str:
         "audio_url": audio_url,
         "speaker_labels": False
     }
-    r = requests.post(
-        "https://api.assemblyai.com/v2/transcript",
+    return assemblyai_upstream.call(_post_transcript, payload)["id"]
+
+
+def _get_transcript(tid: str) -> dict:
+    r = requests.get(
+        f"https://api.assemblyai.com/v2/transcript/{tid}",
         headers=HEADERS,
-        json=payload
+        timeout=ASSEMBLYAI_TIMEOUT
     )
     r.raise_for_status()
-    return r.json()["id"]
+    return r.json()
 
 
 def wait_for_result(tid: str) -> dict:
     """Poll for transcription result"""
+    deadline = time.monotonic() + TRANSCRIPTION_DEADLINE
     while True:
-        r = requests.get(
-            f"https://api.assemblyai.com/v2/transcript/{tid}",
-            headers=HEADERS
-        )
-        r.raise_for_status()
-        res = r.json()
+        res = assemblyai_upstream.call(_get_transcript, tid)
 
         if res["status"] == "completed":
             return res
@@ -132,25 +320,26 @@ def wait_for_result(tid: str) -> dict:
         if res["status"] == "error":
             raise RuntimeError(res["error"])
 
-        time.sleep(3)
+        if time.monotonic() + POLL_INTERVAL > deadline:
+            raise UpstreamUnavailable(
+                "assemblyai", f"transcript {tid} not ready after {TRANSCRIPTION_DEADLINE}s"
+            )
 
+        time.sleep(POLL_INTERVAL)
 
-def parse_medication_info(transcript_json: dict) -> dict:
-    """Parse medication information from transcript"""
-    text = transcript_json.get("text", "")
-    
-    if not text:
-        return {}
 
-    prompt = f"""
+# Static extraction instructions, sent as a cacheable system prefix
+MEDICATION_PROMPT = PromptTemplate(
+    "voice-medication",
+    """
 You are a medication information extraction system.
 
-Extract medication details from the user's voice input and return ONLY valid JSON.
-No markdown. No explanations. No code blocks.
+Extract the details of EVERY medicine in the user's voice input and return ONLY a valid JSON array,
+one object per medicine. No markdown. No explanations. No code blocks.
 
-The JSON MUST strictly follow this structure:
+Each object MUST follow this structure:
 
-{{
+{
   "name": string (medicine name),
   "type": string (one of: "tablet", "syrup", "other"),
   "intakeTimes": [string] (array of: "Before Breakfast", "After Breakfast", "Before Lunch", "After Lunch", "Before Dinner", "After Dinner"),
@@ -161,9 +350,10 @@ The JSON MUST strictly follow this structure:
   "doseCount": number (tablets count or ml for syrup, default 1 for tablet, 5 for syrup),
   "isCritical": boolean (is this a critical medication),
   "durationDays": number (duration in days)
-}}
+}
 
 Rules:
+- One object per distinct medicine, in the order they are mentioned
 - Extract medicine name carefully
 - Identify type: tablet, syrup, or other
 - Parse meal-related timings (before/after breakfast/lunch/dinner)
@@ -174,33 +364,39 @@ Rules:
 - Extract dosage/quantity
 - Check if medication is mentioned as critical/important
 - Extract duration if mentioned
-- Use reasonable defaults if information is missing
+- Include only the fields that are stated; omit anything not mentioned
+- The input may start or end mid-sentence: still include a medicine whose name is cut off, without "name"
+- No medicines mentioned → return []
 - DO NOT hallucinate - only extract what is clearly stated
 
-User's voice input:
-{text}
-"""
+The user's voice input is given in the next message.
+""",
+    budget_tokens=1500,
+)
 
-    response = groq_client.chat.completions.create(
-        model="llama-3.1-8b-instant",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.1
-    )
 
-    try:
-        content = response.choices[0].message.content.strip()
-        # Remove markdown code blocks if present
-        if content.startswith("```"):
-            content = content.split("```")[1]
-            if content.startswith("json"):
-                content = content[4:]
-        data = json.loads(content)
-    except Exception as e:
-        print(f"JSON Parse Error: {e}", file=sys.stderr)
-        data = {}
+def _named(entries: list) -> List[dict]:
+    return [e for e in entries if isinstance(e, dict) and str(e.get("name", "")).strip()]
+
+
+def _valid_medications(data: Optional[list]) -> bool:
+    """
+    Escalate when the model returned no JSON array or an empty one.
+
+    Nameless entries (a dictation cut at a window edge) count as a valid
+    reading; they are dropped afterwards, since the neighbouring window
+    has the whole medicine.
+    """
+    return bool(data)
 
-    # Provide defaults for missing fields
-    result = {
+
+# Rough size of the JSON reply, for rate limiting
+MEDICATION_REPLY_TOKENS = 800
+
+
+def with_defaults(data: dict) -> dict:
+    """Fill the fields the model left out, as the app expects every one"""
+    return {
         "name": data.get("name", ""),
         "type": data.get("type", "tablet"),
         "intakeTimes": data.get("intakeTimes", []),
@@ -213,7 +409,279 @@ User's voice input:
         "durationDays": data.get("durationDays", 7)
     }
 
-    return result
+
+def parse_medications(text: str) -> List[dict]:
+    """
+    Medicines named in a transcript, as the model stated them.
+
+    Fields the speaker did not mention are left out so readings from
+    overlapping windows can be merged; apply with_defaults() last.
+    """
+    if not text:
+        return []
+
+    prompt = MEDICATION_PROMPT.compile([("", text)])
+    prompt.log()
+
+    def call(model_name: str) -> Optional[list]:
+        response = groq_upstream.call(
+            groq_client.chat.completions.create,
+            model=model_name,
+            messages=prompt.messages(),
+            temperature=0.1,
+            est_tokens=prompt.total_tokens + MEDICATION_REPLY_TOKENS
+        )
+        log_usage(prompt.name, response)
+
+        try:
+            content = response.choices[0].message.content.strip()
+            # Remove markdown code blocks if present
+            if content.startswith("```"):
+                content = content.split("```")[1]
+                if content.startswith("json"):
+                    content = content[4:]
+            data = json.loads(content)
+        except Exception as e:
+            print(f"JSON Parse Error: {e}", file=sys.stderr)
+            return None
+        # A lone object is one medicine
+        if isinstance(data, dict):
+            return [data]
+        return data if isinstance(data, list) else None
+
+    data = extraction_router.run(score_transcript(text), call, _valid_medications)
+    return _named(data or [])
+
+
+def extract_medications(text: str) -> List[dict]:
+    """parse_medications shared across workers; empty results are not cached"""
+    computed = {}
+
+    def compute():
+        computed["data"] = parse_medications(text)
+        return computed["data"] or None
+
+    data = medication_cache.get_or_compute(cache_key(MEDICATION_PROMPT.prefix, text), compute)
+    return data if data is not None else computed.get("data", [])
+
+
+# ===============================
+# CHUNKED TRANSCRIPTION
+# ===============================
+# Recordings longer than CHUNK_MIN_SECONDS are split at pauses into
+# ~SEGMENT_TARGET_SECONDS segments that are transcribed in parallel.
+CHUNK_MIN_SECONDS = 45
+SEGMENT_TARGET_SECONDS = 30
+SEGMENT_OVERLAP_SECONDS = 1.5
+PAUSE_MIN_SECONDS = 0.5
+SEGMENT_WORKERS = 4
+
+_SILENCE_START = re.compile(r"silence_start: (-?[\d.]+)")
+_SILENCE_END = re.compile(r"silence_end: (-?[\d.]+)")
+
+
+async def detect_pauses(input_file: str) -> List[Tuple[float, float]]:
+    """(start, end) of every pause longer than PAUSE_MIN_SECONDS, via ffmpeg silencedetect"""
+    cmd = [
+        "ffmpeg",
+        "-i", input_file,
+        "-af", f"silencedetect=noise={SILENCE_THRESHOLD_DB}dB:d={PAUSE_MIN_SECONDS}",
+        "-f", "null", "-",
+        "-hide_banner"
+    ]
+
+    returncode, _, stderr = await ffmpeg_runner.run(cmd)
+    if returncode != 0:
+        raise RuntimeError(f"FFmpeg error: {stderr.decode()}")
+
+    log = stderr.decode()
+    starts = [float(x) for x in _SILENCE_START.findall(log)]
+    ends = [float(x) for x in _SILENCE_END.findall(log)]
+    return list(zip(starts, ends))
+
+
+def plan_segments(duration: float, pauses: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
+    """
+    Choose cut points at the middle of the pause nearest each target
+    boundary (hard cut if there is no pause within +/-40%).
+
+    Returns the owned (start, end) range of each segment; overlap is added
+    when cutting.
+    """
+    cuts = []
+    position = 0.0
+    while duration - position > SEGMENT_TARGET_SECONDS * 1.4:
+        target = position + SEGMENT_TARGET_SECONDS
+        window = SEGMENT_TARGET_SECONDS * 0.4
+        candidates = [
+            (start + end) / 2 for start, end in pauses
+            if abs((start + end) / 2 - target) <= window and (start + end) / 2 > position
+        ]
+        cut = min(candidates, key=lambda mid: abs(mid - target)) if candidates else target
+        cuts.append(cut)
+        position = cut
+
+    bounds = [0.0, *cuts, duration]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+async def cut_segment(input_file: str, start: float, end: float, out_path: str) -> str:
+    """Extract [start, end] seconds of the (already preprocessed) recording"""
+    cmd = [
+        "ffmpeg", "-y",
+        "-ss", f"{start:.3f}",
+        "-to", f"{end:.3f}",
+        "-i", input_file,
+        "-c", "copy",
+        "-hide_banner",
+        "-loglevel", "error",
+        out_path
+    ]
+
+    returncode, _, stderr = await ffmpeg_runner.run(cmd)
+    if returncode != 0:
+        raise RuntimeError(f"FFmpeg error: {stderr.decode()}")
+    return out_path
+
+
+def transcribe_file(path: str, key: Optional[str] = None) -> dict:
+    """
+    Upload, start and wait for one transcript.
+
+    With a `key` the text and word timings are cached across workers.
+    """
+    def compute() -> dict:
+        transcript = wait_for_result(start_transcription(upload_audio(path)))
+        return {
+            "text": transcript.get("text") or "",
+            "words": [
+                {"start": w["start"], "end": w["end"], "text": w["text"]}
+                for w in transcript.get("words") or []
+            ]
+        }
+
+    if key is None:
+        return compute()
+    return transcript_cache.get_or_compute(key, compute)
+
+
+def _owned_text(transcript: dict, offset: float, owned: Tuple[float, float]) -> str:
+    """
+    Text of the words whose midpoint falls in this segment's owned range,
+    which drops the words duplicated by the overlap on either side.
+    """
+    words = transcript.get("words") or []
+    if not words:
+        return transcript.get("text", "") or ""
+
+    kept = []
+    for word in words:
+        midpoint = offset + (word["start"] + word["end"]) / 2000
+        if owned[0] <= midpoint < owned[1]:
+            kept.append(word["text"])
+    return " ".join(kept)
+
+
+def _medicine_key(name: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+def merge_medications(readings: List[List[dict]]) -> List[dict]:
+    """
+    Merge the medicines read from overlapping windows, in order.
+
+    A medicine near a cut is read from two windows, once whole and once
+    partly. Times are unioned. For any other field stated in both, the
+    reading that states more fields wins, since it is the one that heard
+    the whole dictation.
+    """
+    merged = {}
+    for medicines in readings:
+        for data in medicines:
+            key = _medicine_key(data["name"])
+            if key not in merged:
+                merged[key] = dict(data)
+                continue
+            existing = merged[key]
+            fuller, other = (data, existing) if len(data) > len(existing) else (existing, data)
+            combined = {**other, **fuller}
+            for field in ("intakeTimes", "customTimes"):
+                combined[field] = list(dict.fromkeys(existing.get(field, []) + data.get(field, [])))
+                if not combined[field]:
+                    del combined[field]
+            merged[key] = combined
+    return list(merged.values())
+
+
+async def transcribe_and_extract_chunked(input_file: str, duration: float,
+                                         source_key: Optional[str] = None) -> Tuple[str, List[dict]]:
+    """
+    Transcribe a long recording as parallel overlapping segments.
+
+    Medicines are read from a sliding window of the stitched text: each
+    pair of neighbouring segments, extracted as soon as both are
+    transcribed, so extraction overlaps transcription of the rest. Every
+    cut lies inside some window, so a medicine dictated across a cut is
+    read whole at least once.
+
+    `source_key` identifies the original upload so segment transcripts
+    can be cached. Returns the stitched transcript and the medicines found.
+    """
+    segments = plan_segments(duration, await detect_pauses(input_file))
+    print(f"✂️  Splitting {duration:.1f}s into {len(segments)} segments")
+
+    base = os.path.splitext(os.path.basename(input_file))[0]
+    extension = os.path.splitext(input_file)[1]
+    slots = asyncio.Semaphore(SEGMENT_WORKERS)
+    paths = []
+    pending = []
+
+    async def transcribe(path: str, key: Optional[str]) -> dict:
+        async with slots:
+            return await run_in_threadpool(transcribe_file, path, key)
+
+    try:
+        transcripts = []
+        offsets = []
+        for index, (start, end) in enumerate(segments):
+            cut_start = max(0.0, start - SEGMENT_OVERLAP_SECONDS)
+            cut_end = min(duration, end + SEGMENT_OVERLAP_SECONDS)
+            path = await cut_segment(
+                input_file, cut_start, cut_end,
+                os.path.join("input", f"{base}_seg{index}{extension}")
+            )
+            paths.append(path)
+            offsets.append(cut_start)
+            key = cache_key(source_key, round(cut_start, 3), round(cut_end, 3)) if source_key else None
+            transcripts.append(asyncio.ensure_future(transcribe(path, key)))
+        pending.extend(transcripts)
+
+        # Release segments in order; extraction runs alongside later transcriptions
+        texts = []
+        extractions = []
+        for index, task in enumerate(transcripts):
+            text = _owned_text(await task, offsets[index], segments[index])
+            texts.append(text)
+            print(f"🎤 Segment {index + 1}/{len(segments)} ready ({len(text.split())} words)")
+            if index == 0 and len(transcripts) > 1:
+                continue  # the first window closes with the next segment
+            window = " ".join(t for t in texts[max(0, index - 1):] if t.strip())
+            if window:
+                extraction = asyncio.ensure_future(
+                    run_in_threadpool(extract_medications, window)
+                )
+                extractions.append(extraction)
+                pending.append(extraction)
+
+        medicines = merge_medications(list(await asyncio.gather(*extractions)))
+        return " ".join(t for t in texts if t), medicines
+
+    finally:
+        for task in pending:
+            task.cancel()
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
 
 
 # ===============================
@@ -239,7 +707,18 @@ async def health_check():
     return {
         "status": "Voice processing server is running",
         "timestamp": time.time(),
-        "service": "medication-voice-processor"
+        "service": "medication-voice-processor",
+        "upstreams": {
+            "groq": groq_upstream.snapshot(),
+            "assemblyai": assemblyai_upstream.snapshot()
+        },
+        "routing": {"extraction": extraction_router.snapshot()},
+        "scheduler": {"groq": groq_scheduler.snapshot()},
+        "executors": {"ffmpeg": ffmpeg_runner.snapshot()},
+        "cache": {
+            "transcript": transcript_cache.snapshot(),
+            "medication": medication_cache.snapshot()
+        }
     }
 
 
@@ -255,41 +734,84 @@ async def process_voice(audio: UploadFile = File(...)):
         JSON with extracted medication details
     """
     temp_audio_path = None
-    wav_path = None
+    encoded_path = None
+    timings = {}
     
     try:
-        # Save uploaded file
-        temp_audio_path = f"uploads/{audio.filename}"
-        with open(temp_audio_path, "wb") as buffer:
-            shutil.copyfileobj(audio.file, buffer)
-        
-        print(f"📥 Received audio file: {audio.filename}")
+        # Stream upload with size limit, detect format from content
+        with await ingest_upload(audio, MAX_AUDIO_SIZE, AUDIO_KINDS) as upload:
+            temp_audio_path = upload.save_to("uploads", uuid.uuid4().hex)
+        source_key = await run_in_threadpool(file_key, temp_audio_path)
         
-        # Convert to WAV
-        print("🔄 Converting to WAV...")
-        wav_path = convert_to_wav(temp_audio_path)
+        print(f"📥 Received audio file: {audio.filename} ({upload.kind}, {upload.size} bytes)")
         
-        # Upload to AssemblyAI
-        print("☁️  Uploading to AssemblyAI...")
-        audio_url = upload_audio(wav_path)
+        # Reject long recordings before any conversion or upload
+        duration = await probe_duration(temp_audio_path)
+        if duration is not None and duration > MAX_AUDIO_SECONDS:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Recording too long. Maximum duration is {MAX_AUDIO_SECONDS // 60} minutes."
+            )
         
-        # Start transcription
-        print("🎤 Starting transcription...")
-        transcript_id = start_transcription(audio_url)
+        # Trim silence, cap duration, encode compactly
+        print("🔄 Preprocessing audio...")
+        prepared = await preprocess_audio(temp_audio_path, duration)
+        encoded_path = prepared["path"]
+        timings["preprocess"] = prepared["elapsed_ms"]
+        print(f"   {prepared['seconds_in'] or 0:.1f}s → {prepared['seconds_out']:.1f}s, "
+              f"{prepared['bytes_in']} → {prepared['bytes_out']} bytes ({prepared['codec']})")
         
-        # Wait for result
-        print("⏳ Waiting for transcription...")
-        transcript = wait_for_result(transcript_id)
+        if prepared["seconds_out"] > CHUNK_MIN_SECONDS:
+            # Long dictation: parallel segments, incremental extraction
+            print("🎤 Transcribing in parallel segments...")
+            step = time.perf_counter()
+            _, medicines = await transcribe_and_extract_chunked(
+                encoded_path, prepared["seconds_out"], source_key
+            )
+            timings["transcribe_extract"] = (time.perf_counter() - step) * 1000
+        else:
+            # Upload, transcribe and wait (cached per upload)
+            print("🎤 Transcribing with AssemblyAI...")
+            step = time.perf_counter()
+            transcript = await run_in_threadpool(
+                transcribe_file, encoded_path, cache_key(source_key, "full")
+            )
+            timings["transcribe"] = (time.perf_counter() - step) * 1000
+            
+            # Parse medication info
+            print("🧠 Extracting medication details...")
+            step = time.perf_counter()
+            medicines = await run_in_threadpool(extract_medications, transcript["text"])
+            timings["extract"] = (time.perf_counter() - step) * 1000
         
-        # Parse medication info
-        print("🧠 Extracting medication details...")
-        medication_data = parse_medication_info(transcript)
+        # First medicine stays at the top level for existing clients
+        medicines = [with_defaults(m) for m in medicines]
+        medication_data = dict(medicines[0]) if medicines else with_defaults({})
+        medication_data["medicines"] = medicines
         
         print("✅ Processing complete!")
         print(f"📋 Extracted: {medication_data.get('name', 'Unknown')}")
+        print(f"📊 Uploaded {prepared['bytes_out']} bytes; " +
+              ", ".join(f"{name} {ms:.0f}ms" for name, ms in timings.items()))
         
-        return JSONResponse(content=medication_data)
+        return FastJSONResponse(
+            content=medication_data,
+            headers={
+                "Server-Timing": ", ".join(f"{name};dur={ms:.1f}" for name, ms in timings.items()),
+                "X-Upload-Bytes": str(prepared["bytes_out"])
+            }
+        )
         
+    except HTTPException:
+        raise
+    except UpstreamUnavailable as e:
+        # Fail fast while a provider is degraded instead of holding the client
+        print(f"❌ {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="Voice processing is temporarily unavailable. Please try again shortly.",
+            headers={"Retry-After": "30"}
+        )
     except Exception as e:
         print(f"❌ Error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -298,8 +820,8 @@ async def process_voice(audio: UploadFile = File(...)):
         # Cleanup
         if temp_audio_path and os.path.exists(temp_audio_path):
             os.remove(temp_audio_path)
-        if wav_path and os.path.exists(wav_path):
-            os.remove(wav_path)
+        if encoded_path and os.path.exists(encoded_path):
+            os.remove(encoded_path)
 
 
 # ===============================
@@ -315,9 +837,11 @@ if __name__ == "__main__":
     print("=" * 50)
     print()
     
+    # Import string so uvicorn can start WORKERS processes
     uvicorn.run(
-        app, 
-        host="0.0.0.0", 
+        "audio_to_json_pipeline:app",
+        host="0.0.0.0",
         port=5001,
+        workers=WORKERS,
         log_level="info"
     )
\ No newline at end of file
@@ -0,0 +1,103 @@
+"""
+Compare plain WAV conversion with the silence-trimmed, compressed upload.
+
+Usage (from backend/pipeline, with .env configured):
+    python benchmarks/bench_audio_preprocess.py samples/*.m4a
+    python benchmarks/bench_audio_preprocess.py --transcribe samples/*.m4a
+
+--transcribe also uploads both versions to AssemblyAI and times the
+upload + transcription round-trip (uses API credits).
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_to_json_pipeline import (  # noqa: E402
+    preprocess_audio,
+    probe_duration,
+    upload_audio,
+    start_transcription,
+    wait_for_result,
+)
+
+
+def _convert_to_wav(input_file: str) -> str:
+    """Plain 16 kHz mono WAV, the baseline the server used to upload"""
+    base = os.path.splitext(os.path.basename(input_file))[0]
+    wav_path = os.path.join("input", f"{base}.wav")
+    cmd = [
+        "ffmpeg", "-y", "-i", input_file, "-ac", "1", "-ar", "16000", "-c:a", "pcm_s16le",
+        "-vn", "-hide_banner", "-loglevel", "error", wav_path,
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"FFmpeg error: {result.stderr.decode()}")
+    return wav_path
+
+
+def _transcribe_ms(path: str) -> float:
+    start = time.perf_counter()
+    wait_for_result(start_transcription(upload_audio(path)))
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="sample recordings")
+    parser.add_argument("--transcribe", action="store_true", help="also time AssemblyAI round-trips")
+    args = parser.parse_args()
+
+    header = (f"{'file':<28}{'sec in':>8}{'sec out':>9}{'KB wav':>10}{'KB out':>9}{'ratio':>8}"
+              f"{'wav ms':>8}{'probe ms':>10}{'prep ms':>9}")
+    if args.transcribe:
+        header += f"{'stt wav ms':>12}{'stt out ms':>12}"
+    print(header)
+    print("-" * len(header))
+
+    total_wav = total_out = 0
+    for path in args.files:
+        start = time.perf_counter()
+        wav_path = _convert_to_wav(path)
+        wav_ms = (time.perf_counter() - start) * 1000
+
+        # Same path as process_voice: one probe, reused by preprocess_audio
+        start = time.perf_counter()
+        seconds_in = asyncio.run(probe_duration(path))
+        probe_ms = (time.perf_counter() - start) * 1000
+        prepared = asyncio.run(preprocess_audio(path, seconds_in))
+
+        wav_bytes = os.path.getsize(wav_path)
+        total_wav += wav_bytes
+        total_out += prepared["bytes_out"]
+
+        row = (
+            f"{os.path.basename(path)[:27]:<28}"
+            f"{seconds_in or 0:>8.1f}"
+            f"{prepared['seconds_out']:>9.1f}"
+            f"{wav_bytes / 1024:>10.0f}"
+            f"{prepared['bytes_out'] / 1024:>9.0f}"
+            f"{wav_bytes / max(prepared['bytes_out'], 1):>7.1f}x"
+            f"{wav_ms:>8.0f}"
+            f"{probe_ms:>10.0f}"
+            f"{prepared['elapsed_ms']:>9.0f}"
+        )
+        if args.transcribe:
+            row += f"{_transcribe_ms(wav_path):>12.0f}{_transcribe_ms(prepared['path']):>12.0f}"
+        print(row)
+
+        os.remove(wav_path)
+        os.remove(prepared["path"])
+
+    if total_out:
+        print("-" * len(header))
+        print(f"total: {total_wav / 1024:.0f} KB → {total_out / 1024:.0f} KB "
+              f"({total_wav / total_out:.1f}x fewer bytes uploaded)")
+
+
+if __name__ == "__main__":
+    main()
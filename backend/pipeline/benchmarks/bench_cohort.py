@@ -0,0 +1,145 @@
+"""
+Time the cohort at-risk endpoint on synthetic patients, parsing included.
+
+Usage (from backend/pipeline):
+    python benchmarks/bench_cohort.py
+    python benchmarks/bench_cohort.py --patients 10000 --days 90 --medicines 3
+    python benchmarks/bench_cohort.py --schedules
+    python benchmarks/bench_cohort.py --rows --patients 1000
+
+Each patient gets `--medicines` daily medicines (one critical) logged on
+every day, with a per-patient adherence level so the ranking has
+something to find. The JSON body is POSTed to /cohort/at-risk through
+the ASGI app, so request parsing and validation are part of the time.
+Logs are sent as parallel arrays; --rows sends them per patient as
+{date, medicine, time, status} objects instead.
+
+With --schedules the medicines carry their schedule and half of the
+misses are never logged, so the ranking has to expand schedules to find
+them; the bulk expansion is also timed on its own.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The cohort endpoint never calls Groq, but the app needs a key to import
+os.environ.setdefault("GROQ_API_KEY", "unused")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app import app  # noqa: E402
+from dose_schedule import ScheduleTable  # noqa: E402
+from response_encoding import dumps  # noqa: E402
+
+SLOTS = ["morning", "afternoon", "night"]
+INTAKE_TIMES = ["After Breakfast", "After Lunch", "After Dinner"]
+
+
+def make_payload(count: int, days: int, medicines: int, end: date, schedules: bool = False,
+                 rows: bool = False, seed: int = 7) -> dict:
+    rng = random.Random(seed)
+    day_strings = [(end - timedelta(days=offset)).isoformat() for offset in range(days - 1, -1, -1)]
+    columns = {"patient": [], "date": [], "medicine": [], "time": [], "status": []}
+    patients = []
+    for index in range(count):
+        meds = [
+            {
+                "id": f"m{m}", "name": f"med-{m}", "schedule": [SLOTS[m % len(SLOTS)]],
+                "isCritical": m == 0,
+                "frequency": "Daily" if schedules else None,
+                "intakeTimes": [INTAKE_TIMES[m % len(INTAKE_TIMES)]],
+                "startDate": day_strings[0],
+            }
+            for m in range(medicines)
+        ]
+        miss_rate = rng.choice([0.02, 0.05, 0.1, 0.2, 0.4])
+        logs = []
+        for day in day_strings:
+            for m, med in enumerate(meds):
+                roll = rng.random()
+                if schedules and roll < miss_rate / 2:
+                    continue  # never logged
+                status = "missed" if roll < miss_rate else "delayed" if roll < miss_rate * 1.5 else "taken"
+                if rows:
+                    logs.append({"date": day, "medicine": med["name"], "time": SLOTS[m % len(SLOTS)],
+                                 "status": status})
+                else:
+                    columns["patient"].append(index)
+                    columns["date"].append(day)
+                    columns["medicine"].append(med["name"])
+                    columns["time"].append(SLOTS[m % len(SLOTS)])
+                    columns["status"].append(status)
+        patients.append({"patientId": f"p{index:05d}", "medicines": meds, "logs": logs})
+
+    payload = {"patients": patients, "endDate": end.isoformat(), "days": days}
+    if not rows:
+        payload["logs"] = columns
+    return payload
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=10000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--medicines", type=int, default=3)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--schedules", action="store_true", help="leave some doses unlogged")
+    parser.add_argument("--rows", action="store_true", help="send logs per patient, not as columns")
+    args = parser.parse_args()
+
+    # Yesterday, so every day of the window is past and gets expanded
+    end = date.today() - timedelta(days=1)
+    start = time.perf_counter()
+    payload = make_payload(args.patients, args.days, args.medicines, end, args.schedules, args.rows)
+    payload["topK"] = args.top
+    body = dumps(payload)
+    logs = (sum(len(p["logs"]) for p in payload["patients"]) if args.rows
+            else len(payload["logs"]["patient"]))
+    print(f"generated {args.patients} patients x {args.days} days = {logs} logs, "
+          f"{len(body) / 1e6:.1f}MB {'row' if args.rows else 'columnar'} JSON "
+          f"in {time.perf_counter() - start:.1f}s")
+
+    if args.schedules:
+        medicines = [SimpleNamespace(**m) for p in payload["patients"] for m in p["medicines"]]
+        start = time.perf_counter()
+        table = ScheduleTable(medicines)
+        built = time.perf_counter()
+        expected = table.expand(end - timedelta(days=args.days - 1), args.days)
+        expanded = time.perf_counter()
+        print(f"schedule expansion: {len(medicines)} medicines -> {int(expected.sum())} expected doses "
+              f"(table {(built - start) * 1000:.0f}ms, expand {(expanded - built) * 1000:.0f}ms)")
+        del expected
+
+    # Only the encoded body goes to the server, as in production
+    del payload
+    client = TestClient(app)
+    best = None
+    for run in range(args.repeat):
+        start = time.perf_counter()
+        response = client.post("/cohort/at-risk", content=body, headers={"content-type": "application/json"})
+        elapsed = (time.perf_counter() - start) * 1000
+        response.raise_for_status()
+        result = response.json()
+        timings = result["timings"]
+        print(f"run {run + 1}: total {elapsed:.0f}ms (parse {timings['parse_ms']:.0f}ms, "
+              f"ingest {timings['ingest_ms']:.0f}ms, compute+rank {timings['compute_ms']:.0f}ms)")
+        best = elapsed if best is None else min(best, elapsed)
+
+    print(f"best: {best:.0f}ms, {logs / best * 1000 / 1e6:.1f}M logs/s")
+    print(f"cohort: {result['cohort']}")
+    print("top 5 at risk:")
+    for row in result["topAtRisk"][:5]:
+        print(f"  {row['patientId']}  risk {row['riskScore']:>6}  adherence {row['adherence']:>3}%  "
+              f"critical missed {row['missedCritical']:>3}  unlogged {row['unlogged']:>3}  "
+              f"longest miss streak {row['longestMissStreak']}")
+
+
+if __name__ == "__main__":
+    main()
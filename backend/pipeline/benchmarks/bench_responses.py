@@ -0,0 +1,135 @@
+"""
+Compare stdlib JSON with orjson and measure bytes on the wire.
+
+Usage (from backend/pipeline):
+    python benchmarks/bench_responses.py
+    python benchmarks/bench_responses.py --repeat 50
+
+Payloads mirror the real responses: a year-long daily adherence timeline,
+a cohort ranking and a large prescription extraction.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from adherence_timeline import AdherenceIndex  # noqa: E402
+from cohort_analytics import rank_at_risk  # noqa: E402
+from response_encoding import dumps, compress, brotli, orjson  # noqa: E402
+
+SLOTS = ["morning", "afternoon", "night"]
+
+
+def _logs(rng, days: int, end: date):
+    return [
+        SimpleNamespace(
+            date=(end - timedelta(days=offset)).isoformat(),
+            medicine=f"med-{m}",
+            time=SLOTS[m % len(SLOTS)],
+            status=rng.choice(["taken"] * 8 + ["delayed", "missed"]),
+        )
+        for offset in range(days) for m in range(3)
+    ]
+
+
+def timeline_payload(rng, days: int) -> dict:
+    end = date.today()
+    start = end - timedelta(days=days - 1)
+    index = AdherenceIndex(_logs(rng, days, end), start, end)
+    return {
+        "summary": "Overall adherence is good at 80% across the period.",
+        "timelineData": index.timeline(start, end, "day"),
+        "window": {"start": start.isoformat(), "end": end.isoformat(), **index.counts(start, end)},
+    }
+
+
+def cohort_payload(rng, patients: int, top: int) -> dict:
+    end = date.today()
+    records = [
+        SimpleNamespace(patientId=f"patient-{i:05d}", medicines=[], logs=_logs(rng, 30, end))
+        for i in range(patients)
+    ]
+    return rank_at_risk(records, end, days=30, k=top)
+
+
+def prescription_payload(rng, count: int) -> dict:
+    return {
+        "success": True,
+        "message": f"Successfully extracted {count} medicine(s)",
+        "medicines": [
+            {
+                "name": f"Medicine {i} {rng.choice([250, 500, 650])}mg",
+                "type": "tablet",
+                "intakeTimes": ["After Breakfast", "After Dinner"],
+                "customTimes": [],
+                "frequency": "Daily",
+                "startDay": "Mon",
+                "days": ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"],
+                "doseCount": 1,
+                "isCritical": False,
+                "durationDays": 7,
+            }
+            for i in range(count)
+        ],
+    }
+
+
+def stdlib_dumps(content) -> bytes:
+    # What Starlette's JSONResponse.render does
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def timed(fn, content, repeat: int):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(content)
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    payloads = [
+        ("timeline 90d", timeline_payload(rng, 90)),
+        ("timeline 365d", timeline_payload(rng, 365)),
+        ("cohort top 500", cohort_payload(rng, 2000, 500)),
+        ("prescription x40", prescription_payload(rng, 40)),
+    ]
+
+    print(f"orjson: {'yes' if orjson else 'no (stdlib fallback)'}, brotli: {'yes' if brotli else 'no'}")
+    header = (f"{'payload':<18}{'KB':>8}{'json ms':>9}{'fast ms':>9}{'speedup':>9}"
+              f"{'gzip KB':>9}{'gzip ms':>9}{'br KB':>8}{'br ms':>7}")
+    print(header)
+    print("-" * len(header))
+
+    for name, content in payloads:
+        body, json_ms = timed(stdlib_dumps, content, args.repeat)
+        fast, fast_ms = timed(dumps, content, args.repeat)
+        assert json.loads(body) == json.loads(fast)
+
+        gzipped, gzip_ms = timed(lambda b: compress(b, "gzip"), fast, args.repeat)
+        row = (
+            f"{name:<18}{len(fast) / 1024:>8.1f}{json_ms:>9.2f}{fast_ms:>9.2f}"
+            f"{json_ms / max(fast_ms, 1e-6):>8.1f}x"
+            f"{len(gzipped) / 1024:>9.1f}{gzip_ms:>9.2f}"
+        )
+        if brotli is not None:
+            compressed, br_ms = timed(lambda b: compress(b, "br"), fast, args.repeat)
+            row += f"{len(compressed) / 1024:>8.1f}{br_ms:>7.2f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
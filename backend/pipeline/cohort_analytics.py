@@ -0,0 +1,358 @@
+import heapq
+import time
+from datetime import date, timedelta
+from itertools import repeat
+from types import SimpleNamespace
+from typing import List
+
+import numpy as np
+
+from adherence_timeline import STATUSES, parse_day
+from dose_schedule import ScheduleTable, course_start, is_scheduled, unlogged
+from local_summary import SLOTS
+
+# ===============================
+# CONFIG
+# ===============================
+TAKEN, DELAYED, MISSED = range(len(STATUSES))
+_STATUS_CODE = {status: i for i, status in enumerate(STATUSES)}
+_SLOT_CODE = {slot: i for i, slot in enumerate(SLOTS)}
+
+# Risk score weights; higher is more at risk
+RISK_NONADHERENCE = 1.0      # per percentage point below 100% adherence
+RISK_MISSED_CRITICAL = 8.0   # per missed dose of a critical medicine
+RISK_WEEK_DECLINE = 0.5      # per point adherence fell week over week
+RISK_MISS_STREAK = 3.0       # per day in the longest run of days with a miss
+
+AT_RISK_ADHERENCE = 60       # cohort summary: patients below this are "at risk"
+
+# Longest cohort window, and medicines x days expanded at once; the
+# expansion grids cost about 10 bytes per cell, so a chunk stays ~40MB
+COHORT_MAX_DAYS = 365
+EXPAND_CHUNK_CELLS = 4_000_000
+
+_BAD_DAY = np.iinfo(np.int64).min // 2  # day offset of an unparseable date
+
+
+# ===============================
+# INGEST
+# ===============================
+class CohortLogs:
+    """
+    Every patient's dose logs as flat columns.
+
+    Rows are logs; `patient` indexes into `patient_ids`, `day` is the
+    offset from `start` (very negative for unparseable dates). Rows with `inferred`
+    set are scheduled doses that were never logged, recorded as missed.
+    """
+
+    def __init__(self, patient_ids: List[str], patient, day, status, critical, start: date, days: int,
+                 inferred=None):
+        self.patient_ids = patient_ids
+        self.patient = patient
+        self.day = day
+        self.status = status
+        self.critical = critical
+        self.start = start
+        self.days = days
+        self.inferred = inferred if inferred is not None else np.zeros(len(patient), dtype=bool)
+
+    @classmethod
+    def from_patients(cls, patients, end: date, days: int) -> "CohortLogs":
+        """Flatten patient records (patientId, medicines, logs) for a window ending at `end`"""
+        columns = SimpleNamespace(patient=[], date=[], medicine=[], time=[], status=[])
+        for index, record in enumerate(patients):
+            for log in record.logs:
+                columns.patient.append(index)
+                columns.date.append(log.date)
+                columns.medicine.append(log.medicine)
+                columns.time.append(log.time)
+                columns.status.append(log.status)
+        return cls.from_columns(patients, columns, end, days)
+
+    @classmethod
+    def from_columns(cls, patients, logs, end: date, days: int) -> "CohortLogs":
+        """
+        Build from patient records (patientId, medicines) and columnar logs.
+
+        `logs` has parallel sequences `patient` (index into `patients`),
+        `date`, `medicine`, `time` and `status`. They are mapped to codes
+        with C-level map()/fromiter passes, not a per-log Python loop.
+
+        Medicines with a schedule are expanded to expected doses, and each
+        one without a log (before today) is added as an inferred miss.
+        """
+        start = end - timedelta(days=days - 1)
+        patient_ids = [record.patientId for record in patients]
+
+        # Every medicine gets a row; logs find theirs by (patient, name)
+        row_of = {}
+        critical_rows, scheduled, scheduled_patient = [], [], []
+        scheduled_row = []
+        for index, record in enumerate(patients):
+            for medicine in record.medicines:
+                if (index, medicine.name) in row_of:
+                    continue
+                row_of[index, medicine.name] = len(critical_rows)
+                critical_rows.append(bool(getattr(medicine, "isCritical", False)))
+                if is_scheduled(medicine):
+                    scheduled_row.append(len(scheduled))
+                    scheduled.append(medicine)
+                    scheduled_patient.append(index)
+                else:
+                    scheduled_row.append(-1)
+        # Trailing entry so row -1 (unknown medicine) maps to "not critical/scheduled"
+        medicine_critical = np.array(critical_rows + [False], dtype=bool)
+        medicine_scheduled = np.array(scheduled_row + [-1], dtype=np.int64)
+
+        count = len(logs.patient)
+        patient = np.array(logs.patient, dtype=np.int64)
+        status = np.fromiter(map(_STATUS_CODE.get, logs.status, repeat(-1)), dtype=np.int8, count=count)
+        slot = np.fromiter(map(_SLOT_CODE.get, logs.time, repeat(-1)), dtype=np.int64, count=count)
+        medicine = np.fromiter(
+            map(row_of.get, zip(logs.patient, logs.medicine), repeat(-1)), dtype=np.int64, count=count
+        )
+        day = _day_offsets(logs.date, start)
+
+        keep = (status >= 0) & (patient >= 0) & (patient < len(patients))
+        medicine = medicine[keep]
+        cohort = cls(
+            patient_ids,
+            patient[keep],
+            day[keep],
+            status[keep],
+            medicine_critical[medicine],
+            start,
+            days,
+        )
+        # Today's doses may still be taken, so expansion stops at yesterday
+        elapsed = min(days, (date.today() - start).days)
+        if scheduled and elapsed > 0:
+            starts = [course_start(m) for m in scheduled]
+            if None in starts:
+                _fill_first_logged(starts, medicine_scheduled[medicine], cohort.day, start)
+            cohort._add_unlogged(
+                ScheduleTable(scheduled, starts), np.array(scheduled_patient, dtype=np.int64),
+                np.array([bool(getattr(m, "isCritical", False)) for m in scheduled]),
+                medicine_scheduled[medicine], slot[keep], elapsed,
+            )
+        return cohort
+
+    def _add_unlogged(self, table: ScheduleTable, medicine_patient, medicine_critical,
+                      log_medicine, log_slot, days: int):
+        # Expanded a chunk of medicines at a time so memory does not grow with the cohort;
+        # logs are sorted by medicine so each chunk slices out its own
+        order = np.argsort(log_medicine, kind="stable")
+        log_medicine, log_day, log_slot = log_medicine[order], self.day[order], log_slot[order]
+        step = max(1, EXPAND_CHUNK_CELLS // (days * len(SLOTS)))
+        found = []
+        for first in range(0, len(table), step):
+            last = min(first + step, len(table))
+            lo, hi = np.searchsorted(log_medicine, [first, last])
+            missing = unlogged(
+                table.expand(self.start, days, slice(first, last)),
+                log_medicine[lo:hi] - first, log_day[lo:hi], log_slot[lo:hi],
+            )
+            rows, day, _ = np.nonzero(missing)
+            found.append((rows + first, day))
+        rows = np.concatenate([chunk_rows for chunk_rows, _ in found])
+        day = np.concatenate([chunk_day for _, chunk_day in found])
+        self.patient = np.concatenate([self.patient, medicine_patient[rows]])
+        self.day = np.concatenate([self.day, day.astype(np.int64)])
+        self.status = np.concatenate([self.status, np.full(len(rows), MISSED, dtype=np.int8)])
+        self.critical = np.concatenate([self.critical, medicine_critical[rows]])
+        self.inferred = np.concatenate([self.inferred, np.ones(len(rows), dtype=bool)])
+
+
+def _fill_first_logged(starts: list, log_medicine: np.ndarray, day: np.ndarray, start: date):
+    """Fill unknown course starts with the medicine's first logged day"""
+    first = np.full(len(starts), np.iinfo(np.int64).max, dtype=np.int64)
+    valid = (log_medicine >= 0) & (day != _BAD_DAY)
+    np.minimum.at(first, log_medicine[valid], day[valid])
+    for row, offset in enumerate(first.tolist()):
+        if starts[row] is None and offset != np.iinfo(np.int64).max:
+            starts[row] = start + timedelta(days=offset)
+
+
+def _day_offsets(dates: List[str], start: date) -> np.ndarray:
+    """Days since `start` for ISO dates (or timestamps), parsed in one numpy call"""
+    if max(map(len, dates), default=0) > 10:
+        # Timestamps - keep the local date part; numpy would shift offsets to UTC
+        dates = [d[:10] for d in dates]
+    try:
+        parsed = np.array(dates, dtype="datetime64[D]")
+    except ValueError:
+        # A malformed date somewhere - parse one by one and mark the bad ones
+        parsed = np.array(
+            [parse_day(d) or np.datetime64("NaT") for d in dates], dtype="datetime64[D]"
+        )
+    offsets = (parsed - np.datetime64(start, "D")).astype(np.int64)
+    offsets[np.isnat(parsed)] = _BAD_DAY
+    return offsets
+
+
+# ===============================
+# METRICS
+# ===============================
+def _adherence(taken: np.ndarray, total: np.ndarray) -> np.ndarray:
+    """Percent taken; patients with no logs score 0, as in calculate_medicine_adherence"""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(total > 0, taken / np.maximum(total, 1) * 100, 0.0)
+
+
+def _longest_run(flags: np.ndarray) -> np.ndarray:
+    """Longest run of True along each row"""
+    counts = np.cumsum(flags, axis=1)
+    # Subtract the count at the last False so each run restarts at zero
+    resets = np.maximum.accumulate(np.where(flags, 0, counts), axis=1)
+    return (counts - resets).max(axis=1, initial=0)
+
+
+def _trailing_run(flags: np.ndarray) -> np.ndarray:
+    """Run of True ending at the last column of each row"""
+    reversed_flags = flags[:, ::-1]
+    first_false = np.argmin(reversed_flags, axis=1)
+    return np.where(reversed_flags.all(axis=1), flags.shape[1], first_false)
+
+
+def cohort_metrics(cohort: CohortLogs) -> dict:
+    """
+    Per-patient adherence metrics as numpy arrays, one entry per patient.
+
+    Everything is computed with bincount over the flat log columns, so
+    the cost is linear in the number of logs plus patients x days.
+    """
+    patients, days = len(cohort.patient_ids), cohort.days
+    in_window = (cohort.day >= 0) & (cohort.day < days)
+    patient = cohort.patient[in_window]
+    day = cohort.day[in_window]
+    status = cohort.status[in_window]
+    critical = cohort.critical[in_window]
+    missed = status == MISSED
+    inferred = cohort.inferred[in_window]
+
+    counts = np.bincount(
+        patient * len(STATUSES) + status, minlength=patients * len(STATUSES)
+    ).reshape(patients, len(STATUSES))
+    total = counts.sum(axis=1)
+    adherence = _adherence(counts[:, TAKEN], total)
+
+    missed_critical = np.bincount(patient[missed & critical], minlength=patients)
+    unlogged_doses = np.bincount(patient[inferred], minlength=patients)
+
+    # Week over week: last 7 days against the 7 before
+    def week_adherence(first_day: int):
+        week = (day >= first_day) & (day < first_day + 7)
+        taken = np.bincount(patient[week & (status == TAKEN)], minlength=patients)
+        logged = np.bincount(patient[week], minlength=patients)
+        return _adherence(taken, logged), logged > 0
+
+    this_week, has_this = week_adherence(days - 7)
+    last_week, has_last = week_adherence(days - 14)
+    week_delta = np.where(has_this & has_last, this_week - last_week, 0.0)
+
+    # Patient x day grid: a day is good when something was logged and nothing missed
+    cells = patient * days + day
+    logged_days = np.bincount(cells, minlength=patients * days).reshape(patients, days) > 0
+    missed_days = np.bincount(cells[missed], minlength=patients * days).reshape(patients, days) > 0
+    current_streak = _trailing_run(logged_days & ~missed_days)
+    longest_miss_streak = _longest_run(missed_days)
+
+    risk = (
+        RISK_NONADHERENCE * (100 - adherence)
+        + RISK_MISSED_CRITICAL * missed_critical
+        + RISK_WEEK_DECLINE * np.maximum(-week_delta, 0)
+        + RISK_MISS_STREAK * longest_miss_streak
+    )
+
+    return {
+        "taken": counts[:, TAKEN],
+        "delayed": counts[:, DELAYED],
+        "missed": counts[:, MISSED],
+        "total": total,
+        "adherence": adherence,
+        "missedCritical": missed_critical,
+        "unlogged": unlogged_doses,
+        "weekDelta": week_delta,
+        "currentStreak": current_streak,
+        "longestMissStreak": longest_miss_streak,
+        "risk": risk,
+    }
+
+
+# ===============================
+# RANKING
+# ===============================
+def top_k(scores: List[float], k: int) -> List[int]:
+    """
+    Indices of the k highest scores, highest first.
+
+    A bounded min-heap of size k keeps this O(n log k); ties go to the
+    earlier patient.
+    """
+    heap = []
+    for index, score in enumerate(scores):
+        item = (score, -index)
+        if len(heap) < k:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+    return [-index for _, index in sorted(heap, reverse=True)]
+
+
+def rank_at_risk(patients, end: date, days: int = 90, k: int = 20, logs=None) -> dict:
+    """
+    Cohort summary plus the k patients most at risk over the window ending at `end`.
+
+    Only patients with at least one dose (logged or inferred) in the window
+    are ranked or averaged; the rest are reported as `noDoses`.
+
+    `logs` are columnar logs for the whole cohort (see CohortLogs.from_columns);
+    without them each patient record's own `logs` are used.
+    """
+    started = time.perf_counter()
+    if logs is not None:
+        cohort = CohortLogs.from_columns(patients, logs, end, days)
+    else:
+        cohort = CohortLogs.from_patients(patients, end, days)
+    ingested = time.perf_counter()
+    metrics = cohort_metrics(cohort)
+    # Patients with no doses in the window have nothing to score; they are
+    # counted separately instead of ranking as 0% adherent
+    scored = np.flatnonzero(metrics["total"] > 0)
+    ranked = [int(scored[i]) for i in top_k(metrics["risk"][scored].tolist(), k)]
+    finished = time.perf_counter()
+
+    def row(index: int) -> dict:
+        return {
+            "patientId": cohort.patient_ids[index],
+            "riskScore": round(float(metrics["risk"][index]), 1),
+            "adherence": round(float(metrics["adherence"][index])),
+            "taken": int(metrics["taken"][index]),
+            "delayed": int(metrics["delayed"][index]),
+            "missed": int(metrics["missed"][index]),
+            "total": int(metrics["total"][index]),
+            "missedCritical": int(metrics["missedCritical"][index]),
+            "unlogged": int(metrics["unlogged"][index]),
+            "weekDelta": round(float(metrics["weekDelta"][index])),
+            "currentStreak": int(metrics["currentStreak"][index]),
+            "longestMissStreak": int(metrics["longestMissStreak"][index]),
+        }
+
+    adherence = metrics["adherence"][scored]
+    return {
+        "window": {"start": cohort.start.isoformat(), "end": end.isoformat(), "days": days},
+        "cohort": {
+            "patients": len(cohort.patient_ids),
+            "noDoses": len(cohort.patient_ids) - len(scored),
+            "logs": int(metrics["total"].sum() - metrics["unlogged"].sum()),
+            "unlogged": int(metrics["unlogged"].sum()),
+            "meanAdherence": round(float(adherence.mean())) if len(adherence) else None,
+            "atRisk": int((adherence < AT_RISK_ADHERENCE).sum()),
+        },
+        "topAtRisk": [row(index) for index in ranked],
+        "timings": {
+            "ingest_ms": round((ingested - started) * 1000, 1),
+            "compute_ms": round((finished - ingested) * 1000, 1),
+        },
+    }
@@ -0,0 +1,221 @@
+from datetime import date, timedelta
+from typing import List, Optional
+
+import numpy as np
+
+from adherence_timeline import parse_day
+from local_summary import SLOTS
+
+# ===============================
+# SCHEDULE VOCABULARY
+# ===============================
+# Same vocabulary as the extraction prompts and the medicine model
+DAY_NAMES = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+FREQUENCIES = {"Daily": 0, "Alternate Days": 1, "Specific Days": 2}
+
+INTAKE_SLOTS = {
+    "Before Breakfast": "morning",
+    "After Breakfast": "morning",
+    "Before Lunch": "afternoon",
+    "After Lunch": "afternoon",
+    "Before Dinner": "night",
+    "After Dinner": "night",
+}
+
+_SLOT_INDEX = {slot: i for i, slot in enumerate(SLOTS)}
+
+# Courses without a duration run open-ended; rows with no known start never expand
+_NO_END = np.iinfo(np.int64).max // 2
+
+# 1970-01-01 was a Thursday; (epoch day + 3) % 7 gives Mon=0 .. Sun=6
+_WEEKDAY_SHIFT = 3
+
+
+def _epoch_day(day: date) -> int:
+    return (day - date(1970, 1, 1)).days
+
+
+def time_slot(value: str) -> Optional[str]:
+    """'08:30' / '8:30 PM' to morning (<12h), afternoon (<17h) or night"""
+    text = str(value).strip().upper()
+    meridiem = None
+    if text.endswith(("AM", "PM")):
+        text, meridiem = text[:-2].strip(), text[-2:]
+    try:
+        hour = int(text.split(":")[0])
+    except ValueError:
+        return None
+    if meridiem == "PM" and hour < 12:
+        hour += 12
+    elif meridiem == "AM" and hour == 12:
+        hour = 0
+    if not 0 <= hour < 24:
+        return None
+    return "morning" if hour < 12 else "afternoon" if hour < 17 else "night"
+
+
+def dose_slots(medicine) -> List[str]:
+    """Slots a medicine is taken in, from intakeTimes, customTimes and schedule"""
+    found = set()
+    for label in getattr(medicine, "intakeTimes", None) or []:
+        if label in INTAKE_SLOTS:
+            found.add(INTAKE_SLOTS[label])
+    for value in getattr(medicine, "customTimes", None) or []:
+        slot = time_slot(value)
+        if slot:
+            found.add(slot)
+    for entry in getattr(medicine, "schedule", None) or []:
+        slot = entry if entry in _SLOT_INDEX else INTAKE_SLOTS.get(entry) or time_slot(entry)
+        if slot:
+            found.add(slot)
+    return [slot for slot in SLOTS if slot in found]
+
+
+def is_scheduled(medicine) -> bool:
+    """Only medicines with a known frequency and at least one slot are expanded"""
+    return getattr(medicine, "frequency", None) in FREQUENCIES and bool(dose_slots(medicine))
+
+
+def course_start(medicine, first_logged: Optional[date] = None) -> Optional[date]:
+    """
+    First day of a medicine's course: startDate, else the day the medicine
+    was added (createdAt - the Node backend starts alarms that day), else
+    its first logged dose. None when nothing is known.
+    """
+    for value in (getattr(medicine, "startDate", None), getattr(medicine, "createdAt", None)):
+        day = parse_day(value) if value else None
+        if day is not None:
+            return day
+    return first_logged
+
+
+def course_days(medicine) -> Optional[int]:
+    """
+    Calendar days the course spans, as the Node backend schedules alarms:
+    durationDays days for Daily / Specific Days, durationDays doses two
+    days apart for Alternate Days. None when there is no duration.
+    """
+    duration = getattr(medicine, "durationDays", None)
+    if not duration:
+        return None
+    if medicine.frequency == "Alternate Days":
+        return 2 * int(duration) - 1
+    return int(duration)
+
+
+# ===============================
+# BULK EXPANSION
+# ===============================
+class ScheduleTable:
+    """
+    Schedule parameters of many medicines as parallel arrays.
+
+    `expand` turns them into a medicines x days x slots grid of expected
+    doses with broadcast comparisons - no per-day Python loop.
+
+    `starts` gives each medicine's course start (see course_start); by
+    default it comes from the medicine itself. A medicine with no start
+    is never expanded - without one its course cannot be placed in time.
+    """
+
+    def __init__(self, medicines: list, starts: Optional[List[Optional[date]]] = None):
+        count = len(medicines)
+        self.first_day = np.full(count, _NO_END, dtype=np.int64)
+        self.last_day = np.full(count, _NO_END, dtype=np.int64)   # exclusive
+        self.frequency = np.zeros(count, dtype=np.int8)
+        self.weekdays = np.zeros(count, dtype=np.int16)           # bit per DAY_NAMES entry
+        self.slots = np.zeros(count, dtype=np.int16)              # bit per SLOTS entry
+
+        for row, medicine in enumerate(medicines):
+            frequency = FREQUENCIES[medicine.frequency]
+            self.frequency[row] = frequency
+            self.slots[row] = sum(1 << _SLOT_INDEX[slot] for slot in dose_slots(medicine))
+            self.weekdays[row] = sum(
+                1 << DAY_NAMES.index(day) for day in (getattr(medicine, "days", None) or DAY_NAMES)
+                if day in DAY_NAMES
+            )
+
+            start = starts[row] if starts is not None else course_start(medicine)
+            if start is None:
+                continue
+            # Alternate Days doses fall on the first day of the course and every second day after
+            self.first_day[row] = _epoch_day(start)
+            span = course_days(medicine)
+            if span is not None:
+                self.last_day[row] = _epoch_day(start) + span
+
+    def __len__(self) -> int:
+        return len(self.frequency)
+
+    def expand(self, start: date, days: int, rows: slice = slice(None)) -> np.ndarray:
+        """Expected doses as a bool array of shape (medicines, days, len(SLOTS)), for `rows` only"""
+        day = np.arange(days, dtype=np.int64) + _epoch_day(start)
+        weekday = (day + _WEEKDAY_SHIFT) % 7
+
+        first = self.first_day[rows, None]
+        active = (day >= first) & (day < self.last_day[rows, None])
+
+        frequency = self.frequency[rows, None]
+        alternate = (day - first) % 2 == 0
+        specific = ((self.weekdays[rows, None] >> weekday) & 1).astype(bool)
+        on_day = np.where(frequency == FREQUENCIES["Alternate Days"], alternate,
+                          np.where(frequency == FREQUENCIES["Specific Days"], specific, True))
+
+        in_slot = ((self.slots[rows, None] >> np.arange(len(SLOTS))) & 1).astype(bool)
+        return (active & on_day)[:, :, None] & in_slot[:, None, :]
+
+
+def unlogged(expected: np.ndarray, medicine, day, slot) -> np.ndarray:
+    """
+    Expected doses with no log of any status.
+
+    `medicine`, `day` and `slot` are parallel index arrays of the logs
+    (rows outside the grid are ignored).
+    """
+    _, days, _ = expected.shape
+    keep = (medicine >= 0) & (day >= 0) & (day < days) & (slot >= 0)
+    logged = np.zeros_like(expected)
+    logged[medicine[keep], day[keep], slot[keep]] = True
+    return expected & ~logged
+
+
+# ===============================
+# SINGLE PATIENT
+# ===============================
+def missed_unlogged(medicines, logs, start: date, end: date) -> List[dict]:
+    """
+    Log-shaped "missed" entries for every expected dose in [start, end]
+    that the patient never logged. Unscheduled medicines are skipped.
+    """
+    scheduled = [m for m in medicines if is_scheduled(m)]
+    days = (end - start).days + 1
+    if not scheduled or days <= 0:
+        return []
+
+    row_of = {m.name: row for row, m in enumerate(scheduled)}
+    first_logged = {}
+    medicine, day, slot = [], [], []
+    for log in logs:
+        logged_day = parse_day(log.date)
+        medicine.append(row_of.get(log.medicine, -1))
+        day.append((logged_day - start).days if logged_day else -1)
+        slot.append(_SLOT_INDEX.get(log.time, -1))
+        if logged_day and (log.medicine not in first_logged or logged_day < first_logged[log.medicine]):
+            first_logged[log.medicine] = logged_day
+
+    starts = [course_start(m, first_logged.get(m.name)) for m in scheduled]
+    missing = unlogged(
+        ScheduleTable(scheduled, starts).expand(start, days),
+        np.array(medicine, dtype=np.int64),
+        np.array(day, dtype=np.int64),
+        np.array(slot, dtype=np.int64),
+    )
+    return [
+        {
+            "date": (start + timedelta(days=int(d))).isoformat(),
+            "medicine": scheduled[m].name,
+            "time": SLOTS[s],
+            "status": "missed",
+        }
+        for m, d, s in zip(*np.nonzero(missing))
+    ]
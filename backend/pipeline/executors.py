@@ -0,0 +1,238 @@
+import os
+import time
+import asyncio
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+# ===============================
+# ERRORS
+# ===============================
+class PoolSaturated(HTTPException):
+    """Every worker is busy and the queue is full - the client should back off"""
+
+    def __init__(self, name: str, retry_after: int = 2):
+        super().__init__(
+            status_code=429,
+            detail=f"Server is busy ({name}). Please retry shortly.",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+# ===============================
+# ADMISSION + TIMING
+# ===============================
+class _Admission:
+    """In-flight limit (workers + queue slots) with queue/run time tracking"""
+
+    def __init__(self, name: str, workers: int, max_queue: int):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self._queue_ms = deque(maxlen=200)
+        self._run_ms = deque(maxlen=200)
+        self.stats = {"completed": 0, "rejected": 0, "timeouts": 0, "errors": 0}
+
+    def acquire(self):
+        if self.in_flight >= self.workers + self.max_queue:
+            self.stats["rejected"] += 1
+            raise PoolSaturated(self.name)
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+
+    def record(self, queue_ms: float, run_ms: float):
+        self.stats["completed"] += 1
+        self._queue_ms.append(queue_ms)
+        self._run_ms.append(run_ms)
+
+    def snapshot(self) -> dict:
+        def mean(samples):
+            return round(sum(samples) / len(samples), 1) if samples else None
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "mean_queue_ms": mean(self._queue_ms),
+            "mean_run_ms": mean(self._run_ms),
+            **self.stats,
+        }
+
+
+# ===============================
+# PROCESS POOL
+# ===============================
+def _timed_call(fn: Callable, args: tuple):
+    """Runs in the worker; wall-clock stamps let the parent split queue and run time"""
+    started = time.time()
+    result = fn(*args)
+    return result, started, time.time()
+
+
+def _warm_up():
+    return os.getpid()
+
+
+class ManagedProcessPool:
+    """
+    Pre-forked process pool for CPU-bound work (image decode, PDF rasterize).
+
+    Work is submitted from async handlers without blocking the event loop.
+    At most `workers + max_queue` tasks are admitted; beyond that callers
+    get a 429 instead of an ever-growing queue. A task that times out
+    keeps its slot until its worker really finishes it, and a pool broken
+    by a dead worker (segfault, OOM kill) is rebuilt.
+    """
+
+    def __init__(self, name: str, workers: Optional[int] = None, max_queue: int = 8,
+                 task_timeout: float = 60.0):
+        self.workers = workers or max(1, min(4, (os.cpu_count() or 2) - 1))
+        self.task_timeout = task_timeout
+        self._admission = _Admission(name, self.workers, max_queue)
+        self._admission.stats["restarts"] = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def start(self):
+        """Fork the workers now, while the server process is still single-threaded"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("fork"),
+            )
+            for _ in range(self.workers):
+                self._executor.submit(_warm_up).result()
+            print(f"⚙️  {self._admission.name}: {self.workers} worker processes ready")
+
+    def _restart(self, broken: ProcessPoolExecutor):
+        """Replace a pool whose worker died; concurrent callers rebuild it once"""
+        if self._executor is not broken:
+            return
+        broken.shutdown(wait=False, cancel_futures=True)
+        # Replacement workers are forked on demand by the next submissions
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("fork"),
+        )
+        self._admission.stats["restarts"] += 1
+        print(f"♻️  {self._admission.name}: a worker died, pool rebuilt")
+
+    def _release_when_done(self, future: asyncio.Future):
+        """Slot release for a task that outlived its timeout"""
+        if not future.cancelled():
+            future.exception()  # retrieved, so asyncio does not log it
+        self._admission.release()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, fn: Callable, *args, timeout: Optional[float] = None):
+        """
+        Run `fn(*args)` in a worker process.
+
+        `fn` and its arguments/result must be picklable (module-level
+        functions, bytes, plain data).
+        """
+        self._admission.acquire()
+        held = True
+        try:
+            if self._executor is None:
+                self.start()
+            executor = self._executor
+            submitted = time.time()
+            loop = asyncio.get_running_loop()
+            try:
+                future = loop.run_in_executor(executor, _timed_call, fn, args)
+                # shield: a timeout must not cancel the task, it is still running
+                result, started, finished = await asyncio.wait_for(
+                    asyncio.shield(future), timeout or self.task_timeout
+                )
+            except asyncio.TimeoutError:
+                self._admission.stats["timeouts"] += 1
+                # The worker is still busy with it, so the slot stays taken until it ends
+                held = False
+                future.add_done_callback(self._release_when_done)
+                raise HTTPException(status_code=504, detail="Processing took too long.")
+            except BrokenProcessPool:
+                self._admission.stats["errors"] += 1
+                self._restart(executor)
+                raise HTTPException(
+                    status_code=503,
+                    detail="A processing worker crashed. Please retry.",
+                    headers={"Retry-After": "1"},
+                )
+            except Exception:
+                self._admission.stats["errors"] += 1
+                raise
+            self._admission.record((started - submitted) * 1000, (finished - started) * 1000)
+            return result
+        finally:
+            if held:
+                self._admission.release()
+
+    def snapshot(self) -> dict:
+        return self._admission.snapshot()
+
+
+# ===============================
+# ASYNC SUBPROCESS RUNNER
+# ===============================
+class SubprocessRunner:
+    """
+    Runs external tools (ffmpeg/ffprobe) with asyncio subprocesses.
+
+    `max_concurrency` processes run at once, up to `max_queue` more wait
+    for a slot, and anything past that is rejected with 429. A process is
+    killed when it times out or its caller is cancelled.
+    """
+
+    def __init__(self, name: str, max_concurrency: Optional[int] = None, max_queue: int = 8,
+                 timeout: float = 120.0):
+        workers = max_concurrency or max(1, (os.cpu_count() or 2) - 1)
+        self.timeout = timeout
+        self._admission = _Admission(name, workers, max_queue)
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    async def run(self, cmd: List[str], timeout: Optional[float] = None) -> Tuple[int, bytes, bytes]:
+        """Run `cmd` and return (returncode, stdout, stderr); kills it on timeout"""
+        self._admission.acquire()
+        try:
+            if self._slots is None:
+                self._slots = asyncio.Semaphore(self._admission.workers)
+            submitted = time.perf_counter()
+            async with self._slots:
+                started = time.perf_counter()
+                process = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+                try:
+                    stdout, stderr = await asyncio.wait_for(
+                        process.communicate(), timeout or self.timeout
+                    )
+                except asyncio.TimeoutError:
+                    process.kill()
+                    await process.wait()
+                    self._admission.stats["timeouts"] += 1
+                    raise HTTPException(status_code=504, detail="Processing took too long.")
+                except asyncio.CancelledError:
+                    # Client went away or a sibling chunk failed; nobody wants the output
+                    process.kill()
+                    await asyncio.shield(process.wait())
+                    raise
+                finished = time.perf_counter()
+            self._admission.record((started - submitted) * 1000, (finished - started) * 1000)
+            return process.returncode, stdout, stderr
+        finally:
+            self._admission.release()
+
+    def snapshot(self) -> dict:
+        return self._admission.snapshot()
@@ -1,19 +1,35 @@
 import os
 import json
 import re
-import io
+from contextlib import asynccontextmanager
 from datetime import datetime
 
 
-from typing import List
+from typing import List, Optional, Tuple
 
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 import uvicorn
 
 from dotenv import load_dotenv
-from PIL import Image
+
+from executors import ManagedProcessPool
+from llm_scheduler import LLMScheduler
+from model_router import ModelRouter
+from page_render import RenderedPage, render_document
+from prompt_compiler import PromptTemplate, CompiledPrompt, log_usage
+from resilience import Upstream, CircuitBreaker, UpstreamUnavailable
+from response_encoding import FastJSONResponse, CompressionMiddleware
+from shared_cache import SharedCache, cache_key
+from upload_ingest import (
+    ingest_upload,
+    BodySizeLimitMiddleware,
+    UploadSniffMiddleware,
+    DOCUMENT_KINDS,
+    MULTIPART_OVERHEAD,
+)
+from vision_packing import pack_pages, merge_medicines, estimate_image_tokens
 
 import google.generativeai as genai
 from datetime import datetime
@@ -32,10 +48,76 @@ if not GEMINI_API_KEY:
 genai.configure(api_key=GEMINI_API_KEY)
 model = genai.GenerativeModel("gemini-2.5-flash")
 
+# Clean scans and typed PDF pages go to flash-lite; phone photos and
+# handwritten prescriptions stay on flash
+extraction_router = ModelRouter(
+    "prescription-extraction",
+    fast_model="gemini-2.5-flash-lite",
+    heavy_model="gemini-2.5-flash",
+)
+_models = {"gemini-2.5-flash": model}
+
+
+def _gemini_model(name: str) -> genai.GenerativeModel:
+    if name not in _models:
+        _models[name] = genai.GenerativeModel(name)
+    return _models[name]
+
+
+GEMINI_TIMEOUT = 60  # seconds per generate_content request
+
+# Uvicorn worker processes; all workers on a host share the SQLite cache
+WORKERS = int(os.getenv("WORKERS", "1"))
+
+# Gemini quota; this is the only server on the Gemini key, so it gets all of
+# it, split evenly across its worker processes
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "10"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "250000"))
+gemini_scheduler = LLMScheduler("gemini", GEMINI_RPM / WORKERS, GEMINI_TPM / WORKERS)
+
+# Extraction is idempotent, so slow calls get a hedged duplicate
+gemini_upstream = Upstream(
+    "gemini",
+    timeout=GEMINI_TIMEOUT,
+    retries=2,
+    hedge=True,
+    hedge_min_delay=2.0,
+    breaker=CircuitBreaker(failure_threshold=5, reset_timeout=30.0),
+    scheduler=gemini_scheduler,
+)
+
+# Same file bytes → same medicines, shared across workers
+extraction_cache = SharedCache("prescription", ttl=24 * 3600)
+
+# Image decode + PDF rasterize run here, off the event loop
+# Split the cores between uvicorn workers so pools don't oversubscribe
+render_pool = ManagedProcessPool(
+    "render",
+    workers=max(1, min(4, (os.cpu_count() or 2) // WORKERS)),
+    max_queue=8,
+    task_timeout=60.0
+)
+
 # ===============================
 # FASTAPI APP
 # ===============================
-app = FastAPI(title="MediBuddy Prescription Image + PDF Server")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Fork the render workers before serving, while the process is single-threaded
+    render_pool.start()
+    yield
+    render_pool.shutdown()
+
+
+app = FastAPI(
+    title="MediBuddy Prescription Image + PDF Server",
+    default_response_class=FastJSONResponse,
+    lifespan=lifespan
+)
+
+MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+MAX_FILES = 8                     # per multi-file request
+MAX_PAGES = 20                    # images + PDF pages per multi-file request
 
 app.add_middleware(
     CORSMiddleware,
@@ -45,6 +127,43 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Reject oversized bodies while they stream in, before multipart buffering
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    max_bytes=MAX_FILE_SIZE + MULTIPART_OVERHEAD,
+    path_limits={
+        "/api/medicine/extract-files": MAX_FILES * (MAX_FILE_SIZE + MULTIPART_OVERHEAD)
+    }
+)
+
+# 415 for disguised files as soon as their first bytes arrive
+app.add_middleware(
+    UploadSniffMiddleware,
+    path_kinds={
+        "/api/medicine/extract-file": DOCUMENT_KINDS,
+        "/api/medicine/extract-files": DOCUMENT_KINDS,
+    }
+)
+
+# brotli/gzip for large JSON responses, when the client accepts it
+app.add_middleware(CompressionMiddleware)
+
+
+# ===============================
+# HEALTH CHECK
+# ===============================
+@app.get("/health")
+def health_check():
+    return {
+        "status": "ok",
+        "message": "Prescription server is running",
+        "upstreams": {"gemini": gemini_upstream.snapshot()},
+        "routing": {"extraction": extraction_router.snapshot()},
+        "scheduler": {"gemini": gemini_scheduler.snapshot()},
+        "executors": {"render": render_pool.snapshot()},
+        "cache": extraction_cache.snapshot()
+    }
+
 # ===============================
 # HELPERS
 # ===============================
@@ -54,8 +173,11 @@ def _clean_json(text: str) -> str:
     return text.strip()
 
 
-def _extract_from_image(image: Image.Image) -> List[dict]:
-    prompt = """
+# Static extraction instructions. Sent ahead of the image so the identical
+# prefix is reused by the provider's prompt cache across requests.
+PRESCRIPTION_PROMPT = PromptTemplate(
+    "prescription-image",
+    """
 You are a medical prescription extraction system. Analyze this prescription image carefully.
 
 Extract ALL medicines visible in the prescription and return ONLY valid JSON.
@@ -176,20 +298,72 @@ IMPORTANT GUIDELINES:
 - ALWAYS double-check that intakeTimes match the exact required strings
 
 Return ONLY the JSON array, nothing else.
-"""
-    response = model.generate_content([image, prompt])
+""",
+)
+
+
+# Rough size of the JSON reply, for rate limiting
+EXTRACTION_REPLY_TOKENS = 800
+
+
+def _request_medicines(model_name: str, prompt: CompiledPrompt, images: List[dict],
+                       image_tokens: int = 0) -> Optional[list]:
+    """One vision call; None if the reply is not a JSON array"""
+    response = gemini_upstream.call(
+        _gemini_model(model_name).generate_content,
+        prompt.parts(*images),
+        request_options={"timeout": GEMINI_TIMEOUT},
+        est_tokens=prompt.total_tokens + image_tokens + EXTRACTION_REPLY_TOKENS
+    )
+    log_usage(prompt.name, response)
     cleaned = _clean_json(response.text)
 
     try:
         raw = json.loads(cleaned)
-        if not isinstance(raw, list):
-            return []
     except Exception:
+        return None
+    return raw if isinstance(raw, list) else None
+
+
+def _valid_extraction(raw: Optional[list], expect_medicines: bool = False) -> bool:
+    """
+    Escalate on unparseable output or entries without a medicine name.
+
+    `[]` is a valid answer for a single photo (it may not be a prescription)
+    but not when `expect_medicines` is set - a typed PDF page or several
+    pages of one prescription with nothing found is a misread.
+    """
+    if raw is None or (expect_medicines and not raw):
+        return False
+    return all(isinstance(med, dict) and str(med.get("name", "")).strip() for med in raw)
+
+
+MULTI_IMAGE_NOTE = (
+    "The {count} images above are consecutive photos or pages of ONE prescription, in order. "
+    "A medicine may be cut across two images: report it once, combining what each image shows."
+)
+
+
+def _extract_from_images(images: List[dict], complexity: float, image_tokens: int = 0,
+                         expect_medicines: bool = False) -> List[dict]:
+    if len(images) > 1:
+        prompt = PRESCRIPTION_PROMPT.compile([("", MULTI_IMAGE_NOTE.format(count=len(images)))])
+    else:
+        prompt = PRESCRIPTION_PROMPT.compile()
+    prompt.log()
+    raw = extraction_router.run(
+        complexity,
+        lambda model_name: _request_medicines(model_name, prompt, images, image_tokens),
+        lambda raw: _valid_extraction(raw, expect_medicines),
+    )
+    if raw is None:
         return []
 
     medicines = []
 
     for med in raw:
+        if not isinstance(med, dict):
+            continue
         med_type = med.get("type", "tablet")
         dose_count = med.get("doseCount", 1 if med_type == "tablet" else 5)
         
@@ -259,102 +433,49 @@ Return ONLY the JSON array, nothing else.
 
     return medicines
 
-def extract_medicines(file_bytes: bytes, filename: str) -> List[dict]:
-    ext = filename.lower().split(".")[-1]
+def _extract_from_pages(pages: List[RenderedPage]) -> Tuple[List[dict], int]:
+    """Pack pages into as few vision calls as fit, then merge across images"""
+    batches = pack_pages(pages)
     all_medicines = []
 
-    # IMAGE
-    if ext in ["jpg", "jpeg", "png"]:
-        try:
-            image = Image.open(io.BytesIO(file_bytes))
-            return _extract_from_image(image)
-        except Exception as e:
-            print(f"Error processing image: {str(e)}")
-            return []
-
-    # PDF - Using PyMuPDF (fitz) - NO external dependencies needed!
-    if ext == "pdf":
+    for batch_num, batch in enumerate(batches):
+        images = [page.blob() for page in batch]
+        complexity = max(page.complexity for page in batch)
+        image_tokens = sum(estimate_image_tokens(page.width, page.height) for page in batch)
+        expect_medicines = len(pages) > 1 or any(page.has_text_layer for page in batch)
         try:
-            import fitz  # PyMuPDF
-            
-            # Open PDF from bytes
-            pdf_document = fitz.open(stream=file_bytes, filetype="pdf")
-            
-            if pdf_document.page_count == 0:
-                print("PDF has no pages")
-                pdf_document.close()
-                return []
-            
-            # Process each page
-            for page_num in range(pdf_document.page_count):
-                try:
-                    page = pdf_document[page_num]
-                    
-                    # Convert page to image (PNG format)
-                    # zoom=2 gives 200 DPI (1=100 DPI, 2=200 DPI)
-                    mat = fitz.Matrix(2, 2)
-                    pix = page.get_pixmap(matrix=mat)
-                    
-                    # Convert pixmap to PIL Image
-                    img_bytes = pix.tobytes("png")
-                    image = Image.open(io.BytesIO(img_bytes))
-                    
-                    # Extract medicines from this page
-                    meds = _extract_from_image(image)
-                    all_medicines.extend(meds)
-                    
-                except Exception as e:
-                    print(f"Error processing PDF page {page_num + 1}: {str(e)}")
-                    continue
-            
-            pdf_document.close()
-            
-            # Deduplicate by name
-            unique = {}
-            for med in all_medicines:
-                if med.get("name"):
-                    unique[med["name"].lower()] = med
-
-            return list(unique.values())
-            
+            all_medicines.extend(_extract_from_images(images, complexity, image_tokens, expect_medicines))
+        except UpstreamUnavailable:
+            raise
         except Exception as e:
-            print(f"Error converting PDF: {str(e)}")
-            return []
+            print(f"Error processing batch {batch_num + 1}/{len(batches)}: {str(e)}")
+            continue
 
-    return []
+    return merge_medicines(all_medicines), len(batches)
 
 
 @app.post("/api/medicine/extract-file")
 async def extract_prescription(file: UploadFile = File(...)):
     try:
-        # Validate file type
-        if not file.filename:
-            raise HTTPException(status_code=400, detail="No filename provided")
-        
-        ext = file.filename.lower().split(".")[-1]
-        if ext not in ["jpg", "jpeg", "png", "pdf"]:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Unsupported file type: {ext}. Only JPG, PNG, and PDF are supported."
-            )
-        
-        # Read file with size limit (10MB)
-        MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
-        file_bytes = await file.read()
-        
-        if len(file_bytes) > MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=400,
-                detail=f"File too large. Maximum size is 10MB."
-            )
-        
-        if len(file_bytes) == 0:
-            raise HTTPException(status_code=400, detail="Empty file uploaded")
-
-        medicines = extract_medicines(file_bytes, file.filename)
+        # Stream the upload with size limit (10MB) and detect type from content
+        with await ingest_upload(file, MAX_FILE_SIZE, DOCUMENT_KINDS) as upload:
+            print(f"📥 Received {upload.kind} ({upload.size} bytes) in {upload.elapsed_ms:.1f}ms")
+            file_bytes = upload.read_bytes()
+
+        key = cache_key(file_bytes)
+        medicines = await run_in_threadpool(extraction_cache.get, key)
+
+        if medicines is None:
+            # Decode/rasterize in the process pool, call the model off the event loop
+            pages = await render_pool.run(render_document, file_bytes, upload.kind)
+            # Empty results are not cached (None), so a failed read is retried next time
+            medicines = await run_in_threadpool(
+                extraction_cache.get_or_compute, key, lambda: _extract_from_pages(pages)[0] or None
+            ) if pages else None
+            medicines = medicines or []
 
         if not medicines:
-            return JSONResponse(
+            return FastJSONResponse(
                 content={
                     "success": False,
                     "message": "No valid medicines detected. Please ensure the image/PDF is clear and contains a prescription.",
@@ -363,7 +484,7 @@ async def extract_prescription(file: UploadFile = File(...)):
                 status_code=200  # Return 200 even if no medicines found
             )
 
-        return JSONResponse(
+        return FastJSONResponse(
             content={
                 "success": True,
                 "message": f"Successfully extracted {len(medicines)} medicine(s)",
@@ -373,6 +494,14 @@ async def extract_prescription(file: UploadFile = File(...)):
 
     except HTTPException:
         raise
+    except UpstreamUnavailable as e:
+        # Fail fast while the provider is degraded instead of holding the client
+        print(f"❌ {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="Prescription extraction is temporarily unavailable. Please try again shortly.",
+            headers={"Retry-After": "30"}
+        )
     except Exception as e:
         # Log the full error for debugging
         print(f"Unexpected error in extract_prescription: {str(e)}")
@@ -384,6 +513,98 @@ async def extract_prescription(file: UploadFile = File(...)):
             detail=f"Error processing file: {str(e)}"
         )
 
+@app.post("/api/medicine/extract-files")
+async def extract_prescription_pages(files: List[UploadFile] = File(...)):
+    """
+    Extract medicines from several photos/PDFs of one prescription.
+
+    Pages are packed into as few vision calls as fit the model's input
+    budget and medicines repeated across images are merged.
+    """
+    try:
+        if len(files) > MAX_FILES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Too many files. Maximum is {MAX_FILES} per request."
+            )
+
+        pages = []
+        digests = []
+        for file in files:
+            with await ingest_upload(file, MAX_FILE_SIZE, DOCUMENT_KINDS) as upload:
+                print(f"📥 Received {upload.kind} ({upload.size} bytes) in {upload.elapsed_ms:.1f}ms")
+                file_bytes = upload.read_bytes()
+            digests.append(cache_key(file_bytes))
+
+            try:
+                pages.extend(await render_pool.run(render_document, file_bytes, upload.kind))
+            except HTTPException:
+                raise
+            except Exception as e:
+                print(f"Error reading {file.filename}: {str(e)}")
+                continue
+
+            if len(pages) > MAX_PAGES:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Too many pages. Maximum is {MAX_PAGES} per request."
+                )
+
+        computed = {}
+
+        def compute():
+            medicines, computed["calls"] = _extract_from_pages(pages)
+            return medicines or None
+
+        key = cache_key(*digests)
+        medicines = await run_in_threadpool(extraction_cache.get_or_compute, key, compute) if pages else None
+        medicines = medicines or []
+        calls = computed.get("calls", 0)  # 0 when served from the cache
+        print(f"✅ {len(pages)} page(s) → {calls} vision call(s), {len(medicines)} medicine(s)")
+
+        if not medicines:
+            return FastJSONResponse(
+                content={
+                    "success": False,
+                    "message": "No valid medicines detected. Please ensure the images/PDFs are clear and contain a prescription.",
+                    "medicines": [],
+                    "pages": len(pages),
+                    "calls": calls
+                },
+                status_code=200  # Return 200 even if no medicines found
+            )
+
+        return FastJSONResponse(
+            content={
+                "success": True,
+                "message": f"Successfully extracted {len(medicines)} medicine(s)",
+                "medicines": medicines,
+                "pages": len(pages),
+                "calls": calls
+            }
+        )
+
+    except HTTPException:
+        raise
+    except UpstreamUnavailable as e:
+        # Fail fast while the provider is degraded instead of holding the client
+        print(f"❌ {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="Prescription extraction is temporarily unavailable. Please try again shortly.",
+            headers={"Retry-After": "30"}
+        )
+    except Exception as e:
+        # Log the full error for debugging
+        print(f"Unexpected error in extract_prescription_pages: {str(e)}")
+        import traceback
+        traceback.print_exc()
+
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error processing files: {str(e)}"
+        )
+
 # ===============================
 # RUN SERVER
 # ===============================
@@ -394,11 +615,14 @@ if __name__ == "__main__":
     print("=" * 50)
     print("📍 http://0.0.0.0:5002")
     print("🎯 POST /api/medicine/extract-file")
+    print("🎯 POST /api/medicine/extract-files")
     print("=" * 50)
 
+    # Import string so uvicorn can start WORKERS processes
     uvicorn.run(
-        app,
+        "image_pdf:app",
         host="0.0.0.0",
         port=5002,
+        workers=WORKERS,
         log_level="info"
     )
@@ -0,0 +1,277 @@
+import time
+import asyncio
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from resilience import LatencyTracker, UpstreamUnavailable
+
+# ===============================
+# PRIORITY CLASSES
+# ===============================
+INTERACTIVE = "interactive"  # a patient/doctor is waiting on the response
+STANDARD = "standard"
+BATCH = "batch"              # bulk report summaries, nightly jobs
+
+PRIORITIES = (INTERACTIVE, STANDARD, BATCH)  # highest first
+
+
+class ClassPolicy:
+    """
+    Limits for one priority class.
+
+    `reserve` is the share of each bucket this class may not dip into,
+    which keeps headroom for higher classes arriving later.
+    """
+
+    def __init__(self, max_concurrency: int, max_wait: float, reserve: float = 0.0):
+        self.max_concurrency = max_concurrency
+        self.max_wait = max_wait
+        self.reserve = reserve
+
+
+DEFAULT_POLICIES = {
+    INTERACTIVE: ClassPolicy(max_concurrency=8, max_wait=10.0),
+    STANDARD: ClassPolicy(max_concurrency=4, max_wait=30.0, reserve=0.1),
+    BATCH: ClassPolicy(max_concurrency=2, max_wait=120.0, reserve=0.3),
+}
+
+
+# ===============================
+# TOKEN BUCKET
+# ===============================
+class TokenBucket:
+    """
+    Refills `per_minute` units per minute up to `burst`.
+
+    Not thread-safe on its own; the scheduler's lock guards it. A request
+    bigger than the bucket is admitted when it is full and leaves it in
+    debt, so it cannot starve.
+    """
+
+    def __init__(self, per_minute: float, burst: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        # Default burst: 10 seconds' worth, at least one request
+        self.capacity = max(1.0, burst if burst is not None else per_minute / 6)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, reserve: float, now: float) -> float:
+        """Seconds until `amount` can be taken while keeping `reserve` of capacity"""
+        self._refill(now)
+        needed = min(self.capacity, min(amount, self.capacity) + reserve * self.capacity)
+        if self.level >= needed:
+            return 0.0
+        return (needed - self.level) / self.rate
+
+    def take(self, amount: float):
+        self.level -= amount
+
+
+# ===============================
+# TICKETS
+# ===============================
+class Ticket:
+    """One admitted call; release() frees its concurrency slot (idempotent)"""
+
+    def __init__(self, scheduler: "LLMScheduler", priority: str, tokens: int):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.scheduler._release(self)
+
+
+class _ClassState:
+    def __init__(self, policy: ClassPolicy):
+        self.policy = policy
+        self.queue = deque()
+        self.running = 0
+        self.queue_time = LatencyTracker()
+        self.gate: Optional[asyncio.Semaphore] = None  # see LLMScheduler.slot
+        self.stats = {"admitted": 0, "timeouts": 0, "hedges_skipped": 0}
+
+
+# ===============================
+# SCHEDULER
+# ===============================
+class LLMScheduler:
+    """
+    Admission control in front of one LLM/vision provider.
+
+    Every call waits here for (1) a concurrency slot in its priority class,
+    (2) its turn - FIFO within a class, and no lower class goes while a
+    higher class with a free slot is waiting - and (3) room in the request
+    and token buckets sized to the provider quota. Calls that wait longer
+    than their class allows raise UpstreamUnavailable, like any other
+    provider outage.
+
+    Blocking - call from worker threads, not the event loop. Async handlers
+    first await slot() so a backlog waits on the loop, not in the threadpool.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: float,
+        tokens_per_minute: Optional[float] = None,
+        policies: Optional[Dict[str, ClassPolicy]] = None,
+    ):
+        self.name = name
+        self._cond = threading.Condition()
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._classes = {
+            priority: _ClassState((policies or DEFAULT_POLICIES)[priority]) for priority in PRIORITIES
+        }
+
+    # ---------- admission ----------
+    def _queued_ahead(self, ticket: Ticket) -> bool:
+        """Someone should go before this ticket"""
+        state = self._classes[ticket.priority]
+        if state.queue and state.queue[0] is not ticket:
+            return True
+        for priority in PRIORITIES[:PRIORITIES.index(ticket.priority)]:
+            higher = self._classes[priority]
+            if higher.queue and higher.running < higher.policy.max_concurrency:
+                return True
+        return False
+
+    def _delay(self, ticket: Ticket, now: float) -> Optional[float]:
+        """0 when admissible, seconds until a bucket refills, or None to wait for a release"""
+        state = self._classes[ticket.priority]
+        if state.running >= state.policy.max_concurrency or self._queued_ahead(ticket):
+            return None
+        reserve = state.policy.reserve
+        delay = self._requests.wait_time(1, reserve, now)
+        if self._tokens is not None and ticket.tokens:
+            delay = max(delay, self._tokens.wait_time(ticket.tokens, reserve, now))
+        return delay
+
+    def _admit(self, ticket: Ticket, now: float):
+        state = self._classes[ticket.priority]
+        state.running += 1
+        state.stats["admitted"] += 1
+        state.queue_time.record(now - ticket.enqueued)
+        self._requests.take(1)
+        if self._tokens is not None:
+            self._tokens.take(ticket.tokens)
+        self._cond.notify_all()
+
+    def acquire(self, priority: str = INTERACTIVE, tokens: int = 0,
+                timeout: Optional[float] = None) -> Ticket:
+        """
+        Wait for admission and return a Ticket; release it when the call ends.
+
+        Raises:
+            UpstreamUnavailable: not admitted within the class's max_wait
+            (or `timeout`, if shorter).
+        """
+        state = self._classes[priority]
+        ticket = Ticket(self, priority, tokens)
+        max_wait = state.policy.max_wait if timeout is None else min(timeout, state.policy.max_wait)
+        deadline = ticket.enqueued + max_wait
+
+        with self._cond:
+            state.queue.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    delay = self._delay(ticket, now)
+                    if delay == 0:
+                        state.queue.popleft()
+                        self._admit(ticket, now)
+                        return ticket
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        state.stats["timeouts"] += 1
+                        raise UpstreamUnavailable(
+                            self.name, f"{priority} call not admitted within {max_wait:.1f}s"
+                        )
+                    self._cond.wait(remaining if delay is None else min(delay, remaining))
+            finally:
+                if ticket in state.queue:
+                    state.queue.remove(ticket)
+                    # Whoever was behind us may be admissible now
+                    self._cond.notify_all()
+
+    @asynccontextmanager
+    async def slot(self, priority: str = INTERACTIVE):
+        """
+        Hold one of the class's max_concurrency slots on the event loop.
+
+        Await this before handing work that calls acquire() to a worker
+        thread: queued calls then wait as coroutines instead of each parking
+        one of the shared threadpool's threads, which /health and other
+        classes need too.
+
+        Raises:
+            UpstreamUnavailable: no slot within the class's max_wait.
+        """
+        state = self._classes[priority]
+        if state.gate is None:
+            state.gate = asyncio.Semaphore(state.policy.max_concurrency)
+        try:
+            await asyncio.wait_for(state.gate.acquire(), state.policy.max_wait)
+        except asyncio.TimeoutError:
+            state.stats["timeouts"] += 1
+            raise UpstreamUnavailable(
+                self.name, f"{priority} call not admitted within {state.policy.max_wait:.1f}s"
+            )
+        try:
+            yield
+        finally:
+            state.gate.release()
+
+    def try_acquire(self, priority: str = INTERACTIVE, tokens: int = 0) -> Optional[Ticket]:
+        """Admit only if nobody is queued and capacity is free right now (for hedges)"""
+        state = self._classes[priority]
+        ticket = Ticket(self, priority, tokens)
+        with self._cond:
+            now = time.monotonic()
+            if not state.queue and self._delay(ticket, now) == 0:
+                self._admit(ticket, now)
+                return ticket
+            state.stats["hedges_skipped"] += 1
+            return None
+
+    def _release(self, ticket: Ticket):
+        with self._cond:
+            self._classes[ticket.priority].running -= 1
+            self._cond.notify_all()
+
+    def snapshot(self) -> dict:
+        """State for /health"""
+        def ms(seconds):
+            return round(seconds * 1000, 1) if seconds is not None else None
+
+        with self._cond:
+            now = time.monotonic()
+            self._requests._refill(now)
+            if self._tokens is not None:
+                self._tokens._refill(now)
+            return {
+                "requests_available": round(self._requests.level, 1),
+                "tokens_available": round(self._tokens.level) if self._tokens is not None else None,
+                "classes": {
+                    priority: {
+                        "running": state.running,
+                        "waiting": len(state.queue),
+                        "max_concurrency": state.policy.max_concurrency,
+                        "p50_queue_ms": ms(state.queue_time.percentile(50)),
+                        "p95_queue_ms": ms(state.queue_time.percentile(95)),
+                        **state.stats,
+                    }
+                    for priority, state in self._classes.items()
+                },
+            }
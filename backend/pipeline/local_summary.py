@@ -0,0 +1,153 @@
+from typing import List, Optional
+
+SLOTS = ["morning", "afternoon", "night"]
+
+# A change of this many percentage points between the first and second half
+# of the timeline counts as a trend
+TREND_THRESHOLD = 10
+
+# Above these sizes a history is handed to the LLM in "auto" mode
+SIMPLE_MAX_MEDICINES = 4
+SIMPLE_MAX_LOGS = 60
+
+
+# ===============================
+# METRICS
+# ===============================
+def _day_adherence(day: dict) -> Optional[float]:
+    """Share of resolved slots taken on one timeline day (None if nothing logged)"""
+    statuses = [day.get(slot) for slot in SLOTS]
+    resolved = [s for s in statuses if s in ("taken", "delayed", "missed")]
+    if not resolved:
+        return None
+    return resolved.count("taken") / len(resolved) * 100
+
+
+def detect_trend(timeline_data: List[dict]) -> Optional[dict]:
+    """Compare adherence in the first and second half of the timeline"""
+    scores = [_day_adherence(day) for day in timeline_data]
+    scores = [s for s in scores if s is not None]
+    if len(scores) < 4:
+        return None
+
+    half = len(scores) // 2
+    earlier = sum(scores[:half]) / half
+    recent = sum(scores[-half:]) / half
+    delta = recent - earlier
+
+    if delta >= TREND_THRESHOLD:
+        direction = "improving"
+    elif delta <= -TREND_THRESHOLD:
+        direction = "declining"
+    else:
+        direction = "stable"
+
+    return {"direction": direction, "earlier": round(earlier), "recent": round(recent)}
+
+
+def worst_slot(logs) -> Optional[dict]:
+    """Time slot with the most missed or delayed doses"""
+    counts = {slot: 0 for slot in SLOTS}
+    for log in logs:
+        if log.time in counts and log.status in ("missed", "delayed"):
+            counts[log.time] += 1
+
+    slot = max(SLOTS, key=lambda s: counts[s])
+    if counts[slot] == 0:
+        return None
+    return {"slot": slot, "count": counts[slot]}
+
+
+def worst_medicine(medicine_data: List[dict], logs) -> Optional[dict]:
+    """Lowest-adherence medicine among those that have logs"""
+    logged = {log.medicine for log in logs}
+    candidates = [m for m in medicine_data if m["name"] in logged]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda m: m["adherence"])
+
+
+# ===============================
+# MODE SELECTION
+# ===============================
+def is_simple_history(medicines, logs, medicine_data: List[dict]) -> bool:
+    """
+    True when a templated summary says everything the LLM would.
+
+    Small regimens with a modest log count qualify; many medicines or
+    several poorly-adhered medicines are left to the LLM.
+    """
+    if len(medicines) > SIMPLE_MAX_MEDICINES or len(logs) > SIMPLE_MAX_LOGS:
+        return False
+    struggling = [m for m in medicine_data if m["adherence"] < 60]
+    return len(struggling) <= 1
+
+
+# ===============================
+# SUMMARY
+# ===============================
+def _describe_level(adherence: int) -> str:
+    if adherence >= 90:
+        return "excellent"
+    if adherence >= 75:
+        return "good"
+    if adherence >= 50:
+        return "suboptimal"
+    return "poor"
+
+
+def generate_local_summary(
+    medicines,
+    logs,
+    timeline_data: List[dict],
+    medicine_data: List[dict],
+) -> str:
+    """Build a 2-3 sentence clinical summary from the computed metrics"""
+    total = len(logs)
+    if total == 0:
+        return (
+            f"No doses have been logged yet for {len(medicines)} prescribed medication(s). "
+            "Adherence cannot be assessed until doses are recorded."
+        )
+
+    taken = sum(1 for log in logs if log.status == "taken")
+    delayed = sum(1 for log in logs if log.status == "delayed")
+    missed = sum(1 for log in logs if log.status == "missed")
+    overall = round(taken / total * 100)
+
+    sentences = [
+        f"Overall adherence is {_describe_level(overall)} at {overall}% across {total} scheduled doses "
+        f"({taken} taken, {delayed} delayed, {missed} missed)."
+    ]
+
+    # Trend and timing
+    trend = detect_trend(timeline_data)
+    slot = worst_slot(logs)
+    parts = []
+    if trend and trend["direction"] != "stable":
+        parts.append(
+            f"adherence is {trend['direction']} over the past week "
+            f"({trend['earlier']}% to {trend['recent']}%)"
+        )
+    elif trend:
+        parts.append("adherence has been stable over the past week")
+    if slot:
+        parts.append(f"most missed or delayed doses fall in the {slot['slot']} slot ({slot['count']})")
+    if parts:
+        sentence = ", and ".join(parts) if len(parts) == 2 else parts[0]
+        sentences.append(sentence[0].upper() + sentence[1:] + ".")
+
+    # Medicine of concern
+    worst = worst_medicine(medicine_data, logs)
+    if worst and worst["adherence"] < 75 and len(medicine_data) > 1:
+        sentences.append(
+            f"{worst['name']} has the lowest adherence at {worst['adherence']}% and should be reviewed with the patient."
+        )
+    elif missed == 0 and delayed == 0:
+        sentences.append("No missed or delayed doses were recorded; no intervention is indicated.")
+    elif worst and worst["adherence"] < 75:
+        sentences.append("Follow-up on missed doses is recommended.")
+    else:
+        sentences.append("Occasional missed or delayed doses were recorded; continue routine monitoring.")
+
+    return " ".join(sentences[:3])
@@ -0,0 +1,130 @@
+import time
+import threading
+from collections import deque
+from typing import Any, Callable, Dict
+
+# ===============================
+# COMPLEXITY SIGNALS
+# ===============================
+# Each scorer maps raw request features to 0.0 (trivial) .. 1.0 (hard).
+# Requests scoring below the router threshold go to the fast model.
+
+def _ramp(value: float, easy: float, hard: float) -> float:
+    """0 at/below `easy`, 1 at/above `hard`, linear in between"""
+    if value <= easy:
+        return 0.0
+    if value >= hard:
+        return 1.0
+    return (value - easy) / (hard - easy)
+
+
+def score_transcript(text: str) -> float:
+    """Long dictations and ones naming several medicines/times are harder to structure"""
+    words = len(text.split())
+    numbers = sum(1 for token in text.split() if any(ch.isdigit() for ch in token))
+    return max(_ramp(words, 40, 200), _ramp(numbers, 4, 12))
+
+
+def score_summary(medicine_count: int, log_count: int) -> float:
+    """Many medicines or long histories need more reasoning to summarise"""
+    return max(_ramp(medicine_count, 3, 8), _ramp(log_count, 42, 150))
+
+
+def score_document(
+    width: int,
+    height: int,
+    has_text_layer: bool = False,
+    text_chars: int = 0,
+) -> float:
+    """
+    Small, clean scans are easy; large photos without a text layer
+    (handwritten or photographed prescriptions) are hard.
+
+    A PDF page with a real text layer is typed, which the fast model reads
+    reliably; a dense text layer (long medicine list) raises the score.
+    """
+    megapixels = (width * height) / 1_000_000
+    if has_text_layer:
+        return _ramp(text_chars, 800, 3000) * 0.8
+    return max(0.4, _ramp(megapixels, 1.0, 8.0))
+
+
+# ===============================
+# ROUTER
+# ===============================
+class ModelRouter:
+    """
+    Chooses between a fast and a heavy model per call.
+
+    `run` sends the call to the model picked by the complexity score and,
+    if the fast model's output fails validation, retries once on the heavy
+    model. Route decisions and per-route latency are recorded for /health.
+    """
+
+    def __init__(self, name: str, fast_model: str, heavy_model: str, threshold: float = 0.5):
+        self.name = name
+        self.fast_model = fast_model
+        self.heavy_model = heavy_model
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._latency: Dict[str, deque] = {"fast": deque(maxlen=200), "heavy": deque(maxlen=200)}
+        self.stats = {"fast": 0, "heavy": 0, "escalated": 0, "validation_failures": 0}
+
+    def choose(self, score: float) -> str:
+        return "heavy" if score >= self.threshold else "fast"
+
+    def model_for(self, route: str) -> str:
+        return self.heavy_model if route == "heavy" else self.fast_model
+
+    def _timed(self, route: str, call: Callable[[str], Any]):
+        start = time.perf_counter()
+        try:
+            return call(self.model_for(route))
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.stats[route] += 1
+                self._latency[route].append(elapsed)
+
+    def run(
+        self,
+        score: float,
+        call: Callable[[str], Any],
+        validate: Callable[[Any], bool],
+    ):
+        """
+        Run `call(model_name)` on the routed model.
+
+        Returns the first result that passes `validate`; if neither passes,
+        the heavy model's result is returned as-is for the caller's defaults.
+        """
+        route = self.choose(score)
+        print(f"🧭 {self.name}: complexity {score:.2f} → {route} ({self.model_for(route)})")
+
+        result = self._timed(route, call)
+        if validate(result):
+            return result
+
+        with self._lock:
+            self.stats["validation_failures"] += 1
+        if route == "heavy":
+            return result
+
+        print(f"🧭 {self.name}: fast output failed validation, escalating to {self.heavy_model}")
+        with self._lock:
+            self.stats["escalated"] += 1
+        return self._timed("heavy", call)
+
+    def snapshot(self) -> dict:
+        """Route counts and mean latency for /health"""
+        with self._lock:
+            latency = {
+                route: round(sum(samples) / len(samples) * 1000, 1) if samples else None
+                for route, samples in self._latency.items()
+            }
+            return {
+                "models": {"fast": self.fast_model, "heavy": self.heavy_model},
+                "threshold": self.threshold,
+                "mean_latency_ms": latency,
+                **self.stats,
+            }
@@ -0,0 +1,87 @@
+import io
+from dataclasses import dataclass
+from typing import List
+
+from PIL import Image
+
+from model_router import score_document
+from vision_packing import fit_image
+
+# ===============================
+# RENDERED PAGES
+# ===============================
+# Everything here runs inside the process pool, so it must stay free of
+# API clients and only exchange picklable data with the server process.
+JPEG_QUALITY = 90
+PDF_ZOOM = 2  # zoom=2 gives 200 DPI (1=100 DPI, 2=200 DPI)
+
+
+@dataclass
+class RenderedPage:
+    """One image/PDF page, downscaled and re-encoded, ready for a vision call"""
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+    complexity: float
+    has_text_layer: bool = False
+
+    def blob(self) -> dict:
+        """Inline image part accepted by generate_content"""
+        return {"mime_type": self.mime_type, "data": self.data}
+
+
+def _encode(image: Image.Image, complexity: float, has_text_layer: bool = False) -> RenderedPage:
+    image = fit_image(image)
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=JPEG_QUALITY)
+    return RenderedPage(out.getvalue(), "image/jpeg", image.width, image.height, complexity, has_text_layer)
+
+
+def render_document(file_bytes: bytes, kind: str) -> List[RenderedPage]:
+    """Decode an image or rasterize a PDF into pages with a complexity score"""
+    # IMAGE
+    if kind in ("jpeg", "png"):
+        image = Image.open(io.BytesIO(file_bytes))
+        complexity = score_document(image.width, image.height)
+        return [_encode(image, complexity)]
+
+    # PDF - Using PyMuPDF (fitz) - NO external dependencies needed!
+    if kind == "pdf":
+        import fitz  # PyMuPDF
+
+        pages = []
+        pdf_document = fitz.open(stream=file_bytes, filetype="pdf")
+        try:
+            if pdf_document.page_count == 0:
+                print("PDF has no pages")
+                return []
+
+            for page_num in range(pdf_document.page_count):
+                try:
+                    page = pdf_document[page_num]
+
+                    # Rasterize straight into a PIL image (no PNG round-trip)
+                    pix = page.get_pixmap(matrix=fitz.Matrix(PDF_ZOOM, PDF_ZOOM))
+                    image = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+
+                    # Typed pages carry a text layer and route to the fast model
+                    page_text = page.get_text().strip()
+                    complexity = score_document(
+                        image.width, image.height,
+                        has_text_layer=bool(page_text),
+                        text_chars=len(page_text)
+                    )
+                    pages.append(_encode(image, complexity, bool(page_text)))
+
+                except Exception as e:
+                    print(f"Error processing PDF page {page_num + 1}: {str(e)}")
+                    continue
+        finally:
+            pdf_document.close()
+
+        return pages
+
+    return []
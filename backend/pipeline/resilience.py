@@ -0,0 +1,322 @@
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Optional
+
+# ===============================
+# ERRORS
+# ===============================
+class UpstreamUnavailable(RuntimeError):
+    """The provider could not produce a result in time (open circuit, deadline or exhausted retries)"""
+
+    def __init__(self, upstream: str, reason: str):
+        super().__init__(f"{upstream} unavailable: {reason}")
+        self.upstream = upstream
+        self.reason = reason
+
+
+TRANSIENT_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+_TRANSIENT_NAMES = ("Timeout", "Connection", "ServiceUnavailable", "DeadlineExceeded",
+                    "ResourceExhausted", "InternalServerError", "RateLimit")
+
+
+def _status_of(exc: BaseException) -> Optional[int]:
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        response = getattr(exc, "response", None)
+        status = getattr(response, "status_code", None)
+    if status is None:
+        code = getattr(exc, "code", None)
+        status = code if isinstance(code, int) else None
+    return status
+
+
+def is_transient(exc: BaseException) -> bool:
+    """Timeouts, connection drops, 429 and 5xx are worth retrying; bad requests are not"""
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    status = _status_of(exc)
+    if status is not None:
+        return status in TRANSIENT_STATUS
+    name = type(exc).__name__
+    return any(marker in name for marker in _TRANSIENT_NAMES)
+
+
+# ===============================
+# LATENCY TRACKING
+# ===============================
+class LatencyTracker:
+    """Rolling window of successful call latencies (seconds)"""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            if not self._samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def __len__(self):
+        return len(self._samples)
+
+
+# ===============================
+# CIRCUIT BREAKER
+# ===============================
+class CircuitBreaker:
+    """
+    closed -> open after `failure_threshold` consecutive failures,
+    open -> half_open after `reset_timeout` seconds (one trial call),
+    half_open -> closed on success, back to open on failure.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+                self._trial_in_flight = False
+            # Half open: let exactly one trial call through
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def cancel_trial(self):
+        """The half-open trial never reached the provider; let the next call try"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+# ===============================
+# UPSTREAM CALLER
+# ===============================
+# Shared by every Upstream in the process; attempts that lose a hedge or
+# outlive their deadline finish here in the background.
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="upstream")
+
+
+class Upstream:
+    """
+    Wraps calls to one provider with a per-call deadline, jittered retries,
+    a hedged second request and a circuit breaker.
+
+    Hedging fires a duplicate attempt once the first has been running longer
+    than the provider's observed p95 latency, and takes whichever answers
+    first. Only enable it for idempotent calls.
+
+    With a `scheduler` (llm_scheduler.LLMScheduler) every attempt is
+    admitted by it first; hedges only fire when it has capacity to spare.
+    Time queued for admission is bounded by the priority class's max_wait,
+    not by the call timeout, and a queue timeout is never charged to the
+    circuit breaker - it says nothing about the provider's health.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        timeout: float = 30.0,
+        retries: int = 2,
+        backoff_base: float = 0.25,
+        backoff_max: float = 4.0,
+        hedge: bool = False,
+        hedge_percentile: float = 95.0,
+        hedge_min_delay: float = 0.5,
+        hedge_min_samples: int = 20,
+        breaker: Optional[CircuitBreaker] = None,
+        scheduler=None,
+    ):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker()
+        self.scheduler = scheduler
+        self.latency = LatencyTracker()
+        self.stats = {"calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0,
+                      "failures": 0, "short_circuited": 0}
+
+    # ---------- helpers ----------
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: uniform in [0, min(max, base * 2^attempt)]
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def hedge_delay(self) -> Optional[float]:
+        if not self.hedge or len(self.latency) < self.hedge_min_samples:
+            return None
+        p = self.latency.percentile(self.hedge_percentile)
+        return max(self.hedge_min_delay, p) if p is not None else None
+
+    def _submit(self, fn: Callable, args, kwargs, ticket=None):
+        future = _executor.submit(fn, *args, **kwargs)
+        if ticket is not None:
+            # The slot is held until the request really ends, even past our deadline
+            future.add_done_callback(lambda _: ticket.release())
+        return future
+
+    def _attempt(self, fn: Callable, deadline: float, args, kwargs, ticket=None,
+                 priority: str = "interactive", est_tokens: int = 0):
+        """Run one (possibly hedged) admitted attempt and return its result or raise"""
+        started = time.monotonic()
+        primary = self._submit(fn, args, kwargs, ticket)
+        pending = {primary}
+
+        delay = self.hedge_delay()
+        if delay is not None and delay < deadline - started:
+            done, _ = wait(pending, timeout=delay)
+            if not done:
+                hedge_ticket = None
+                if self.scheduler is not None:
+                    hedge_ticket = self.scheduler.try_acquire(priority, est_tokens)
+                if self.scheduler is None or hedge_ticket is not None:
+                    self.stats["hedges"] += 1
+                    pending.add(self._submit(fn, args, kwargs, hedge_ticket))
+
+        error = None
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if future is not primary:
+                    self.stats["hedge_wins"] += 1
+                self.latency.record(time.monotonic() - started)
+                return result
+
+        if error is not None:
+            raise error
+        raise TimeoutError(f"{self.name} call exceeded {self.timeout:.1f}s")
+
+    # ---------- public ----------
+    def call(self, fn: Callable, *args, timeout: Optional[float] = None,
+             priority: str = "interactive", est_tokens: int = 0, **kwargs):
+        """
+        Call `fn(*args, **kwargs)` under this provider's policy.
+
+        `priority` and `est_tokens` (prompt + expected reply) are used for
+        admission when the upstream has a scheduler.
+
+        `timeout` covers time spent calling the provider (attempts and
+        backoff); waiting for admission is bounded by the scheduler.
+
+        Raises:
+            UpstreamUnavailable: circuit open, not admitted in time, deadline
+            hit or retries exhausted on transient errors.
+            Exception: non-transient errors from `fn` are re-raised as-is.
+        """
+        self.stats["calls"] += 1
+
+        if not self.breaker.allow():
+            self.stats["short_circuited"] += 1
+            raise UpstreamUnavailable(self.name, "circuit open")
+
+        budget = timeout or self.timeout
+        spent = 0.0  # provider time so far; queueing for admission is not counted
+        last_error: Optional[BaseException] = None
+
+        for attempt in range(self.retries + 1):
+            ticket = None
+            if self.scheduler is not None:
+                try:
+                    ticket = self.scheduler.acquire(priority, est_tokens)
+                except UpstreamUnavailable:
+                    # Queued too long in the scheduler; the provider itself is fine
+                    self.breaker.cancel_trial()
+                    raise
+
+            started = time.monotonic()
+            try:
+                result = self._attempt(fn, started + budget - spent, args, kwargs, ticket,
+                                       priority, est_tokens)
+                self.breaker.record_success()
+                return result
+            except Exception as e:
+                last_error = e
+                if not is_transient(e):
+                    # The provider answered; the request itself was bad
+                    self.breaker.record_success()
+                    raise
+            spent += time.monotonic() - started
+
+            if attempt == self.retries:
+                break
+            pause = self._backoff(attempt)
+            if spent + pause >= budget:
+                break
+            self.stats["retries"] += 1
+            print(f"⚠️ {self.name} transient error ({type(last_error).__name__}), retrying in {pause:.2f}s")
+            time.sleep(pause)
+            spent += pause
+
+        self.stats["failures"] += 1
+        self.breaker.record_failure()
+        raise UpstreamUnavailable(self.name, f"{type(last_error).__name__}: {last_error}")
+
+    def snapshot(self) -> dict:
+        """State for /health"""
+        p50 = self.latency.percentile(50)
+        p95 = self.latency.percentile(95)
+        return {
+            "circuit": self.breaker.state,
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            **self.stats,
+        }
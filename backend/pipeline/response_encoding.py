@@ -0,0 +1,149 @@
+import gzip
+import json
+from typing import Any, Optional
+
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+try:
+    import orjson
+except ImportError:  # stdlib json still works, just slower
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# ===============================
+# CONFIG
+# ===============================
+COMPRESS_MIN_BYTES = 1024          # smaller bodies are not worth the CPU
+THREADPOOL_MIN_BYTES = 256 * 1024  # compress large bodies off the event loop
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5                 # near gzip speed, noticeably smaller
+
+_COMPRESSIBLE_TYPES = (b"application/json", b"text/")
+
+
+# ===============================
+# JSON
+# ===============================
+def dumps(content: Any) -> bytes:
+    """Compact UTF-8 JSON; orjson when installed (also handles numpy values)"""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson; used as every server's default response class"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+# ===============================
+# COMPRESSION
+# ===============================
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """Best encoding the client accepts: "br", then "gzip", else None"""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    def allowed(name: str) -> bool:
+        return accepted.get(name, accepted.get("*", 0.0)) > 0
+
+    if brotli is not None and allowed("br"):
+        return "br"
+    if allowed("gzip"):
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    """
+    Compress response bodies with brotli or gzip, as negotiated.
+
+    Only complete (non-streamed) bodies of at least `minimum_size` bytes
+    with a JSON/text content type are compressed; everything else passes
+    through untouched.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    def _eligible(self, start: dict, body: bytes) -> bool:
+        if len(body) < self.minimum_size or start["status"] in (204, 304):
+            return False
+        headers = dict(start.get("headers", []))
+        if b"content-encoding" in headers:
+            return False
+        return headers.get(b"content-type", b"").startswith(_COMPRESSIBLE_TYPES)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept = dict(scope.get("headers", [])).get(b"accept-encoding", b"").decode("latin-1")
+        encoding = negotiate(accept)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        held_start = None
+
+        async def compressing_send(message):
+            nonlocal held_start
+            if message["type"] == "http.response.start":
+                # Hold the headers until we know whether the body gets compressed
+                held_start = message
+                return
+
+            if message["type"] == "http.response.body" and held_start is not None:
+                start, held_start = held_start, None
+                body = message.get("body", b"")
+                if message.get("more_body", False) or not self._eligible(start, body):
+                    await send(start)
+                    await send(message)
+                    return
+
+                if len(body) >= THREADPOOL_MIN_BYTES:
+                    body = await run_in_threadpool(compress, body, encoding)
+                else:
+                    body = compress(body, encoding)
+                vary = [value for name, value in start.get("headers", []) if name == b"vary"]
+                headers = [
+                    (name, value) for name, value in start.get("headers", [])
+                    if name not in (b"content-length", b"vary")
+                ]
+                headers += [
+                    (b"content-encoding", encoding.encode()),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"vary", b", ".join(vary + [b"Accept-Encoding"])),
+                ]
+                await send({**start, "headers": headers})
+                await send({"type": "http.response.body", "body": body})
+                return
+
+            await send(message)
+
+        await self.app(scope, receive, compressing_send)
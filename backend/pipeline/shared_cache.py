@@ -0,0 +1,215 @@
+import os
+import json
+import time
+import uuid
+import random
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from typing import Any, Callable, Optional
+
+# ===============================
+# CONFIG
+# ===============================
+# One SQLite file per host, shared by every worker of every server; kept
+# out of the source tree by default.
+CACHE_PATH = os.getenv(
+    "CACHE_PATH", os.path.join(tempfile.gettempdir(), "medibuddy", "medibuddy_cache.sqlite3")
+)
+
+LEASE_SECONDS = 120       # how long a worker may hold the "computing" lease
+POLL_INTERVAL = 0.05      # how often waiters check for the result
+PURGE_PROBABILITY = 0.01  # fraction of writes that also sweep expired rows
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE TABLE IF NOT EXISTS leases (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+"""
+
+
+def cache_key(*parts) -> str:
+    """Stable key from bytes/str/JSON-able parts"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, bytes):
+            data = part
+        elif isinstance(part, str):
+            data = part.encode()
+        else:
+            data = json.dumps(part, sort_keys=True, separators=(",", ":")).encode()
+        digest.update(len(data).to_bytes(8, "big"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def file_key(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """sha256 of a file's contents, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# ===============================
+# SHARED CACHE
+# ===============================
+class SharedCache:
+    """
+    Cross-process cache backed by SQLite in WAL mode.
+
+    Workers on one host share results through a single file. get_or_compute
+    takes a lease row inside an IMMEDIATE transaction, so exactly one call -
+    across workers and across threads of one worker - computes a missing
+    key while the others wait for its result.
+    Values must be JSON-serialisable; None is never cached.
+    """
+
+    def __init__(self, namespace: str, ttl: float, path: str = CACHE_PATH):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.path = path
+        self._local = threading.local()
+        self.stats = {"hits": 0, "misses": 0, "computed": 0, "waited": 0}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connect().executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections are per-thread; reopen after fork too
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    # ---------- plain get / set ----------
+    def get(self, key: str) -> Optional[Any]:
+        row = self._connect().execute(
+            "SELECT value FROM entries WHERE namespace = ? AND key = ? AND expires_at > ?",
+            (self.namespace, key, time.time()),
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        if value is None:
+            return
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (self.namespace, key, json.dumps(value), time.time() + (ttl or self.ttl)),
+        )
+        if random.random() < PURGE_PROBABILITY:
+            now = time.time()
+            conn.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+            conn.execute("DELETE FROM leases WHERE expires_at <= ?", (now,))
+
+    # ---------- leases ----------
+    def _acquire_lease(self, key: str, owner: str) -> bool:
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "DELETE FROM leases WHERE namespace = ? AND key = ? AND expires_at <= ?",
+                (self.namespace, key, now),
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO leases (namespace, key, owner, expires_at) VALUES (?, ?, ?, ?)",
+                (self.namespace, key, owner, now + LEASE_SECONDS),
+            )
+            row = conn.execute(
+                "SELECT owner FROM leases WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row is not None and row[0] == owner
+
+    def _release_lease(self, key: str, owner: str):
+        self._connect().execute(
+            "DELETE FROM leases WHERE namespace = ? AND key = ? AND owner = ?",
+            (self.namespace, key, owner),
+        )
+
+    def _lease_held(self, key: str) -> bool:
+        row = self._connect().execute(
+            "SELECT 1 FROM leases WHERE namespace = ? AND key = ? AND expires_at > ?",
+            (self.namespace, key, time.time()),
+        ).fetchone()
+        return row is not None
+
+    # ---------- get or compute ----------
+    def get_or_compute(self, key: str, compute: Callable[[], Any], ttl: Optional[float] = None):
+        """
+        Return the cached value, or compute it exactly once across workers.
+
+        Blocking - call from a thread (run_in_threadpool) in async handlers.
+        If the lease holder dies or gives up, a waiter takes over.
+        """
+        value = self.get(key)
+        if value is not None:
+            self.stats["hits"] += 1
+            return value
+        self.stats["misses"] += 1
+
+        # One owner per call: threads of the same worker must not share a lease
+        owner = f"{os.getpid()}-{uuid.uuid4().hex}"
+        deadline = time.time() + LEASE_SECONDS
+        while True:
+            if self._acquire_lease(key, owner):
+                try:
+                    # Another worker may have finished between our get and the lease
+                    value = self.get(key)
+                    if value is not None:
+                        return value
+                    value = compute()
+                    self.stats["computed"] += 1
+                    self.set(key, value, ttl)
+                    return value
+                finally:
+                    self._release_lease(key, owner)
+
+            # Someone else is computing: wait for their result
+            self.stats["waited"] += 1
+            while self._lease_held(key) and time.time() < deadline:
+                time.sleep(POLL_INTERVAL)
+                value = self.get(key)
+                if value is not None:
+                    return value
+
+            value = self.get(key)
+            if value is not None:
+                return value
+            if time.time() >= deadline:
+                # Give up waiting; compute locally rather than fail the request
+                return compute()
+            # Holder released without a result (e.g. provider error) - try to take over
+
+    def snapshot(self) -> dict:
+        return {"namespace": self.namespace, "ttl": self.ttl, **self.stats}
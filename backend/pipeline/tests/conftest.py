@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# Tests get their own cache database, so earlier runs cannot turn misses into hits
+os.environ["CACHE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="medibuddy-test-"), "cache.sqlite3")
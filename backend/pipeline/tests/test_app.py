@@ -0,0 +1,111 @@
+import os
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The endpoints under test never reach Groq, but the app needs a key to import
+os.environ.setdefault("GROQ_API_KEY", "unused")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import app as adherence_app  # noqa: E402
+
+client = TestClient(adherence_app.app)
+
+
+def course_payload(**window):
+    """A 7-day daily course that started 30 days ago, with 3 doses logged"""
+    start = date.today() - timedelta(days=30)
+    return {
+        "patientId": "p1",
+        "medicines": [{
+            "id": "m1", "name": "Amoxicillin", "schedule": ["morning"], "frequency": "Daily",
+            "durationDays": 7, "startDate": start.isoformat(),
+        }],
+        "logs": [
+            {"date": (start + timedelta(days=offset)).isoformat(), "medicine": "Amoxicillin",
+             "time": "morning", "status": "taken"}
+            for offset in range(3)
+        ],
+        "summaryMode": "local",
+        **window,
+    }
+
+
+def test_medicine_adherence_does_not_depend_on_the_window():
+    results = [
+        client.post("/analyze-adherence", json=course_payload(**window)).json()
+        for window in ({}, {"startDate": (date.today() - timedelta(days=60)).isoformat()})
+    ]
+    for result in results:
+        assert result["medicineData"] == [{"name": "Amoxicillin", "adherence": 43}]
+        assert result["unloggedDoses"] == 4
+        assert "7 scheduled doses" in result["summary"]
+
+
+def test_summary_prompt_recent_lists_real_logs():
+    payload = adherence_app.AdherenceRequest(**course_payload())
+    logs = adherence_app.add_unlogged_doses(payload, date.today())
+    prompt = adherence_app.build_summary_prompt(payload, logs, [{"name": "Amoxicillin", "adherence": 43}])
+    assert "7 scheduled (4 never logged)" in prompt.dynamic
+    recent = prompt.dynamic.split("Recent")[1]
+    assert "taken" in recent and "missed" not in recent
+
+
+def test_batch_backlog_leaves_interactive_and_health_fast(monkeypatch):
+    import asyncio
+    import time
+    import uuid
+    from types import SimpleNamespace
+
+    import httpx
+
+    from llm_scheduler import LLMScheduler
+
+    def slow_groq(**kwargs):
+        time.sleep(0.5)
+        message = SimpleNamespace(content="Adherence is steady across the course. No action is needed now.")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+    scheduler = LLMScheduler("groq", requests_per_minute=6000, tokens_per_minute=6_000_000)
+    monkeypatch.setattr(adherence_app, "groq_scheduler", scheduler)
+    monkeypatch.setattr(adherence_app.groq_upstream, "scheduler", scheduler)
+    monkeypatch.setattr(adherence_app.groq_client.chat.completions, "create", slow_groq)
+
+    nonce = uuid.uuid4().hex[:8]
+
+    def summary_payload(name, priority):
+        payload = course_payload(summaryMode="llm", priority=priority)
+        payload["medicines"][0]["name"] = payload["logs"][0]["medicine"] = name
+        payload["logs"] = payload["logs"][:1]
+        return payload
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=adherence_app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=120) as http:
+            async def timed(method, url, **kwargs):
+                started = time.perf_counter()
+                response = await http.request(method, url, **kwargs)
+                return response, time.perf_counter() - started
+
+            backlog = [
+                asyncio.create_task(http.post("/analyze-adherence",
+                                              json=summary_payload(f"batch-{nonce}-{i}", "batch")))
+                for i in range(45)
+            ]
+            await asyncio.sleep(0.5)  # let the backlog queue up
+            health, health_seconds = await timed("GET", "/health")
+            interactive, interactive_seconds = await timed(
+                "POST", "/analyze-adherence", json=summary_payload(f"interactive-{nonce}", "interactive")
+            )
+            for task in backlog:
+                task.cancel()
+            await asyncio.gather(*backlog, return_exceptions=True)
+            return health, health_seconds, interactive, interactive_seconds
+
+    health, health_seconds, interactive, interactive_seconds = asyncio.run(scenario())
+    assert health.status_code == 200
+    assert health_seconds < 1.0
+    assert interactive.json()["summarySource"] == "llm"
+    assert interactive_seconds < 2.0
@@ -0,0 +1,33 @@
+import os
+import sys
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cohort_analytics import rank_at_risk  # noqa: E402
+
+END = date.today() - timedelta(days=1)
+
+
+def patient(patient_id, statuses):
+    medicine = SimpleNamespace(name="med", schedule=["morning"], isCritical=False, frequency=None)
+    logs = [
+        SimpleNamespace(date=(END - timedelta(days=offset)).isoformat(), medicine="med",
+                        time="morning", status=status)
+        for offset, status in enumerate(statuses)
+    ]
+    return SimpleNamespace(patientId=patient_id, medicines=[medicine], logs=logs)
+
+
+def test_patients_without_doses_are_not_ranked():
+    patients = [
+        patient("new", []),
+        patient("struggling", ["missed", "taken", "taken", "taken"] * 7),
+    ]
+    result = rank_at_risk(patients, END, days=28, k=5)
+    assert [row["patientId"] for row in result["topAtRisk"]] == ["struggling"]
+    assert result["topAtRisk"][0]["total"] == 28
+    assert result["cohort"]["noDoses"] == 1
+    assert result["cohort"]["meanAdherence"] == 75
+    assert result["cohort"]["atRisk"] == 0
@@ -0,0 +1,124 @@
+import os
+import sys
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cohort_analytics import CohortLogs  # noqa: E402
+from dose_schedule import ScheduleTable, missed_unlogged  # noqa: E402
+
+WINDOW_START = date(2026, 3, 1)  # a Sunday
+WINDOW_DAYS = 28
+
+
+def medicine(frequency, **fields):
+    fields.setdefault("name", "med")
+    fields.setdefault("schedule", ["morning"])
+    return SimpleNamespace(frequency=frequency, **fields)
+
+
+def log(day, status="taken", name="med"):
+    return SimpleNamespace(date=day.isoformat(), medicine=name, time="morning", status=status)
+
+
+def dose_days(med, starts=None):
+    """Window offsets with an expected morning dose"""
+    expected = ScheduleTable([med], starts).expand(WINDOW_START, WINDOW_DAYS)
+    return np.nonzero(expected[0, :, 0])[0].tolist()
+
+
+# ===============================
+# WITH A START DATE
+# ===============================
+def test_daily_runs_for_duration():
+    med = medicine("Daily", startDate="2026-03-03", durationDays=5)
+    assert dose_days(med) == [2, 3, 4, 5, 6]
+
+
+def test_alternate_days_counts_doses_from_start():
+    med = medicine("Alternate Days", startDate="2026-03-03", durationDays=4)
+    assert dose_days(med) == [2, 4, 6, 8]
+
+
+def test_specific_days_filters_duration_window():
+    # Mar 3 is a Tuesday; 10 calendar days end on Mar 12
+    med = medicine("Specific Days", startDate="2026-03-03", durationDays=10, days=["Mon", "Thu"])
+    assert dose_days(med) == [4, 8, 11]
+
+
+def test_open_ended_course_runs_to_window_end():
+    med = medicine("Daily", startDate="2026-03-20")
+    assert dose_days(med) == list(range(19, WINDOW_DAYS))
+
+
+# ===============================
+# WITHOUT A START DATE
+# ===============================
+def test_daily_starts_at_created_at():
+    med = medicine("Daily", createdAt="2026-03-10T09:15:00.000Z", durationDays=3)
+    assert dose_days(med) == [9, 10, 11]
+
+
+def test_alternate_days_starts_at_created_at():
+    med = medicine("Alternate Days", createdAt="2026-03-10T09:15:00.000Z", durationDays=3)
+    assert dose_days(med) == [9, 11, 13]
+
+
+def test_specific_days_starts_at_created_at():
+    med = medicine("Specific Days", createdAt="2026-03-10T09:15:00.000Z", durationDays=7, days=["Sat"])
+    assert dose_days(med) == [13]
+
+
+def test_unknown_start_is_not_expanded():
+    for frequency in ("Daily", "Alternate Days", "Specific Days"):
+        assert dose_days(medicine(frequency, durationDays=7, days=["Mon"])) == []
+
+
+def test_first_log_is_the_fallback_start():
+    med = medicine("Daily", durationDays=7)
+    logs = [log(date(2026, 3, 5)), log(date(2026, 3, 6)), log(date(2026, 3, 7))]
+    missed = missed_unlogged([med], logs, WINDOW_START, WINDOW_START + timedelta(days=89))
+    # Only the four remaining days of the seven-day course count
+    assert [entry["date"] for entry in missed] == ["2026-03-08", "2026-03-09", "2026-03-10", "2026-03-11"]
+
+
+def test_no_start_and_no_logs_infers_nothing():
+    med = medicine("Daily", durationDays=7)
+    assert missed_unlogged([med], [], WINDOW_START, WINDOW_START + timedelta(days=89)) == []
+
+
+# ===============================
+# COHORT INGEST
+# ===============================
+def test_cohort_uses_first_log_fallback():
+    start = date.today() - timedelta(days=30)
+    logs = [log(start + timedelta(days=offset)) for offset in (10, 11, 12)]
+    patients = [SimpleNamespace(patientId="p1", medicines=[medicine("Daily", durationDays=7)], logs=logs)]
+    cohort = CohortLogs.from_patients(patients, date.today() - timedelta(days=1), 30)
+    assert int(cohort.inferred.sum()) == 4
+
+
+def test_cohort_expansion_is_chunked(monkeypatch):
+    import cohort_analytics
+
+    start = date.today() - timedelta(days=20)
+    patients = [
+        SimpleNamespace(
+            patientId=f"p{index}",
+            medicines=[medicine("Daily", name=f"med-{m}", startDate=start.isoformat()) for m in range(3)],
+            logs=[log(start + timedelta(days=day), name=f"med-{day % 3}") for day in range(index, 20)],
+        )
+        for index in range(5)
+    ]
+    end = date.today() - timedelta(days=1)
+    whole = CohortLogs.from_patients(patients, end, 20)
+    monkeypatch.setattr(cohort_analytics, "EXPAND_CHUNK_CELLS", 1)
+    chunked = CohortLogs.from_patients(patients, end, 20)
+
+    def inferred(cohort):
+        return sorted(zip(cohort.patient[cohort.inferred].tolist(), cohort.day[cohort.inferred].tolist()))
+    assert inferred(chunked) == inferred(whole)
+    assert len(inferred(whole)) > 0
@@ -0,0 +1,34 @@
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from executors import SubprocessRunner  # noqa: E402
+
+
+def test_cancelled_subprocess_is_killed(tmp_path):
+    pid_file = tmp_path / "pid"
+    runner = SubprocessRunner("test", max_concurrency=1)
+
+    async def scenario():
+        task = asyncio.create_task(
+            runner.run(["sh", "-c", f"echo $$ > {pid_file}; exec sleep 30"])
+        )
+        while not pid_file.exists() or not pid_file.read_text().strip():
+            await asyncio.sleep(0.02)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(scenario())
+    pid = int(pid_file.read_text())
+    try:
+        os.kill(pid, 0)
+        alive = True
+    except ProcessLookupError:
+        alive = False
+    assert not alive
+    assert runner.snapshot()["in_flight"] == 0
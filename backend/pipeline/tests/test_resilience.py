@@ -0,0 +1,57 @@
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_scheduler import ClassPolicy, LLMScheduler, PRIORITIES  # noqa: E402
+from resilience import CircuitBreaker, Upstream, UpstreamUnavailable  # noqa: E402
+
+
+def one_at_a_time(max_wait: float) -> LLMScheduler:
+    policy = ClassPolicy(max_concurrency=1, max_wait=max_wait)
+    return LLMScheduler("test", requests_per_minute=6000, policies={p: policy for p in PRIORITIES})
+
+
+def slow_call():
+    time.sleep(0.3)
+    return "ok"
+
+
+def test_queue_wait_does_not_use_the_call_timeout():
+    # The second call queues ~0.3s behind the first, longer than the 0.2s it
+    # would have had left if queueing came out of its 0.5s timeout
+    upstream = Upstream("test", timeout=0.5, retries=0, breaker=CircuitBreaker(failure_threshold=1),
+                        scheduler=one_at_a_time(max_wait=5.0))
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        first = pool.submit(upstream.call, slow_call)
+        time.sleep(0.05)
+        second = pool.submit(upstream.call, slow_call)
+        assert first.result() == "ok"
+        assert second.result() == "ok"
+    assert upstream.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_queue_timeout_is_not_a_breaker_failure():
+    upstream = Upstream("test", timeout=5.0, retries=0, breaker=CircuitBreaker(failure_threshold=1),
+                        scheduler=one_at_a_time(max_wait=0.1))
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        first = pool.submit(upstream.call, slow_call)
+        time.sleep(0.05)
+        second = pool.submit(upstream.call, slow_call)
+        with pytest.raises(UpstreamUnavailable, match="not admitted"):
+            second.result()
+        assert first.result() == "ok"
+    assert upstream.breaker.state == CircuitBreaker.CLOSED
+    assert upstream.stats["failures"] == 0
+
+
+def test_provider_timeout_still_opens_the_breaker():
+    upstream = Upstream("test", timeout=0.1, retries=0, breaker=CircuitBreaker(failure_threshold=1),
+                        scheduler=one_at_a_time(max_wait=5.0))
+    with pytest.raises(UpstreamUnavailable):
+        upstream.call(slow_call)
+    assert upstream.breaker.state == CircuitBreaker.OPEN
@@ -0,0 +1,51 @@
+import os
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared_cache import SharedCache  # noqa: E402
+
+
+def test_threads_of_one_worker_compute_once(tmp_path):
+    cache = SharedCache("test", ttl=60, path=str(tmp_path / "cache.sqlite3"))
+    calls = []
+    lock = threading.Lock()
+
+    def compute():
+        with lock:
+            calls.append(threading.get_ident())
+        time.sleep(0.3)
+        return {"value": 42}
+
+    barrier = threading.Barrier(4)
+
+    def worker():
+        barrier.wait()
+        return cache.get_or_compute("k", compute)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(lambda _: worker(), range(4)))
+
+    assert results == [{"value": 42}] * 4
+    assert len(calls) == 1
+    assert cache.stats["computed"] == 1
+
+
+def test_waiter_takes_over_when_computation_fails(tmp_path):
+    cache = SharedCache("test", ttl=60, path=str(tmp_path / "cache.sqlite3"))
+    started = threading.Event()
+
+    def failing():
+        started.set()
+        time.sleep(0.2)
+        return None  # provider error: nothing is cached
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        first = pool.submit(cache.get_or_compute, "k", failing)
+        started.wait()
+        second = pool.submit(cache.get_or_compute, "k", lambda: "fresh")
+        assert first.result() is None
+        assert second.result() == "fresh"
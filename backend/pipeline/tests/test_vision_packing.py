@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vision_packing import _same_medicine, merge_medicines  # noqa: E402
+
+
+@pytest.mark.parametrize("a, b", [
+    ("Prednisone", "Prednisolone"),
+    ("Metoprolol", "Metoprolol XL"),
+    ("Losartan", "Losartan H"),
+    ("Vitamin", "Vitamin D3"),
+    ("Amoxicillin 250mg", "Amoxicillin 500mg"),
+    ("Hydroxyzine", "Hydralazine"),
+])
+def test_different_medicines_are_kept_apart(a, b):
+    assert not _same_medicine(a, b)
+    assert not _same_medicine(b, a)
+
+
+@pytest.mark.parametrize("a, b", [
+    ("Paracetamol 500 mg", "PARACETAMOL 500mg."),
+    ("Amoxicil", "Amoxicillin"),          # cut off at the photo edge
+    ("Azithromycin", "Azithromycim"),     # misread character
+    ("Pantoprazole", "Pantoprazo1e"),
+])
+def test_same_medicine_variants_match(a, b):
+    assert _same_medicine(a, b)
+
+
+def test_merge_keeps_both_drugs():
+    merged = merge_medicines([
+        {"name": "Prednisone", "intakeTimes": ["After Breakfast"], "customTimes": []},
+        {"name": "Prednisolone", "intakeTimes": ["After Dinner"], "customTimes": []},
+        {"name": "Metoprolol", "intakeTimes": [], "customTimes": []},
+        {"name": "Metoprolol XL", "intakeTimes": [], "customTimes": []},
+    ])
+    assert [m["name"] for m in merged] == ["Prednisone", "Prednisolone", "Metoprolol", "Metoprolol XL"]
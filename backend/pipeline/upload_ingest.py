@@ -0,0 +1,392 @@
+import os
+import time
+import tempfile
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+from fastapi import UploadFile, HTTPException
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# ===============================
+# LIMITS
+# ===============================
+CHUNK_SIZE = 64 * 1024                 # 64KB per read
+SPOOL_THRESHOLD = 1 * 1024 * 1024      # keep up to 1MB in memory, spill to disk above
+MULTIPART_OVERHEAD = 64 * 1024         # boundary + part headers on top of the file itself
+
+# ===============================
+# MAGIC BYTES
+# ===============================
+# (offset, signature, kind) - checked in order, first match wins
+_SIGNATURES = [
+    (0, b"\xff\xd8\xff", "jpeg"),
+    (0, b"\x89PNG\r\n\x1a\n", "png"),
+    (0, b"%PDF-", "pdf"),
+    (0, b"fLaC", "flac"),
+    (0, b"OggS", "ogg"),
+    (0, b"ID3", "mp3"),
+    (0, b"#!AMR", "amr"),
+    (0, b"\x1a\x45\xdf\xa3", "webm"),
+    (4, b"ftyp", "mp4"),               # m4a / aac recordings from the Flutter app
+]
+
+EXTENSIONS = {
+    "jpeg": "jpg",
+    "png": "png",
+    "pdf": "pdf",
+    "flac": "flac",
+    "ogg": "ogg",
+    "mp3": "mp3",
+    "amr": "amr",
+    "webm": "webm",
+    "mp4": "m4a",
+    "wav": "wav",
+    "aac": "aac",
+}
+
+IMAGE_KINDS = {"jpeg", "png"}
+DOCUMENT_KINDS = IMAGE_KINDS | {"pdf"}
+AUDIO_KINDS = {"wav", "flac", "ogg", "mp3", "amr", "webm", "mp4", "aac"}
+
+SNIFF_BYTES = 16
+
+
+def sniff_kind(head: bytes) -> Optional[str]:
+    """Detect the file kind from its leading bytes"""
+    for offset, signature, kind in _SIGNATURES:
+        if head[offset:offset + len(signature)] == signature:
+            return kind
+
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "wav"
+
+    # Raw MPEG audio / ADTS AAC frames start with an 11/12-bit sync word
+    if len(head) >= 2 and head[0] == 0xFF:
+        if head[1] & 0xF6 == 0xF0:
+            return "aac"
+        if head[1] & 0xE0 == 0xE0:
+            return "mp3"
+
+    return None
+
+
+# ===============================
+# INGESTED UPLOAD
+# ===============================
+@dataclass
+class IngestedUpload:
+    """An upload that passed the size and type checks, held in a spooled buffer"""
+    buffer: tempfile.SpooledTemporaryFile
+    size: int
+    kind: str
+    filename: str
+    elapsed_ms: float = 0.0
+    _closed: bool = field(default=False, repr=False)
+
+    @property
+    def extension(self) -> str:
+        return EXTENSIONS.get(self.kind, self.kind)
+
+    @property
+    def spilled(self) -> bool:
+        """True once the buffer rolled over from memory to a temp file"""
+        return bool(getattr(self.buffer, "_rolled", False))
+
+    def read_bytes(self) -> bytes:
+        self.buffer.seek(0)
+        return self.buffer.read()
+
+    def save_to(self, directory: str, stem: str) -> str:
+        """Write the upload to `directory` under a server-chosen name"""
+        path = os.path.join(directory, f"{stem}.{self.extension}")
+        self.buffer.seek(0)
+        with open(path, "wb") as out:
+            while True:
+                chunk = self.buffer.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                out.write(chunk)
+        return path
+
+    def close(self):
+        if not self._closed:
+            self.buffer.close()
+            self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ===============================
+# STREAMING INGESTION
+# ===============================
+def _too_large(max_bytes: int) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"File too large. Maximum size is {max_bytes // (1024 * 1024)}MB."
+    )
+
+
+async def ingest_upload(
+    upload: UploadFile,
+    max_bytes: int,
+    allowed_kinds: Iterable[str],
+    chunk_size: int = CHUNK_SIZE,
+    spool_threshold: int = SPOOL_THRESHOLD,
+) -> IngestedUpload:
+    """
+    Copy an upload into a spooled buffer, enforcing size and type limits.
+
+    By the time the endpoint runs, Starlette has already received and
+    spooled the whole multipart body, so this is a second pass over data
+    that is already on the server. Early rejection happens in the ASGI
+    middleware below: BodySizeLimitMiddleware stops oversized bodies and
+    UploadSniffMiddleware checks each file's magic bytes as they arrive.
+    The checks here are the authoritative ones for what gets processed.
+
+    Raises:
+        HTTPException: 400 for empty uploads, 413 when `max_bytes` is
+        exceeded, 415 when the content is not one of `allowed_kinds`.
+    """
+    allowed = set(allowed_kinds)
+    start = time.perf_counter()
+
+    declared = getattr(upload, "size", None)
+    if declared is not None and declared > max_bytes:
+        raise _too_large(max_bytes)
+
+    buffer = tempfile.SpooledTemporaryFile(max_size=spool_threshold)
+    size = 0
+    kind = None
+
+    try:
+        while True:
+            chunk = await upload.read(chunk_size)
+            if not chunk:
+                break
+
+            if kind is None:
+                kind = sniff_kind(chunk[:SNIFF_BYTES])
+                if kind not in allowed:
+                    raise HTTPException(
+                        status_code=415,
+                        detail=f"Unsupported file content. Expected one of: {', '.join(sorted(allowed))}."
+                    )
+
+            size += len(chunk)
+            if size > max_bytes:
+                raise _too_large(max_bytes)
+
+            buffer.write(chunk)
+
+        if size == 0:
+            raise HTTPException(status_code=400, detail="Empty file uploaded")
+
+    except BaseException:
+        buffer.close()
+        raise
+
+    buffer.seek(0)
+    return IngestedUpload(
+        buffer=buffer,
+        size=size,
+        kind=kind,
+        filename=upload.filename or "",
+        elapsed_ms=(time.perf_counter() - start) * 1000,
+    )
+
+
+# ===============================
+# EARLY REJECTION (ASGI)
+# ===============================
+class _RejectBody(HTTPException):
+    """Raised from receive(); an HTTPException so FastAPI's body parser re-raises it as-is"""
+
+
+async def _send_error(send, status: int, detail: str):
+    body = ('{"detail":"%s"}' % detail).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"connection", b"close"),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _run_guarded(app, scope, receive, send):
+    """Run `app`, turning a _RejectBody from receive() into its error response"""
+    response_started = False
+
+    async def tracking_send(message):
+        nonlocal response_started
+        if message["type"] == "http.response.start":
+            response_started = True
+        await send(message)
+
+    try:
+        await app(scope, receive, tracking_send)
+    except _RejectBody as rejected:
+        if not response_started:
+            await _send_error(send, rejected.status_code, rejected.detail)
+
+
+class BodySizeLimitMiddleware:
+    """
+    Reject request bodies above `max_bytes` before they are buffered.
+
+    Starlette's multipart parser spools the whole body before the endpoint
+    runs, so this is what stops a 500MB upload at the socket: the declared
+    Content-Length is checked up front and streamed bodies are counted as
+    they are received. `path_limits` overrides the limit for specific
+    routes (e.g. multi-file uploads).
+    """
+
+    def __init__(self, app, max_bytes: int, path_limits: Optional[dict] = None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_limits = path_limits or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        max_bytes = self.path_limits.get(scope.get("path"), self.max_bytes)
+
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    declared = int(value)
+                except ValueError:
+                    declared = 0
+                if declared > max_bytes:
+                    await _send_error(send, 413, "Request body too large")
+                    return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    raise _RejectBody(status_code=413, detail="Request body too large")
+            return message
+
+        await _run_guarded(self.app, scope, limited_receive, send)
+
+
+class _PartSniffer:
+    """
+    Incremental multipart scan that sniffs the first bytes of every file part.
+
+    `rejected` is set as soon as a file part's leading bytes are not one of
+    `allowed`; the rest of that part is never looked at.
+    """
+
+    def __init__(self, boundary: bytes, allowed: set):
+        self.allowed = allowed
+        self.rejected = False
+        self._field = b""
+        self._value = b""
+        self._is_file = False
+        self._head = b""
+        self._checked = False
+        self._broken = False
+        self._parser = MultipartParser(boundary, callbacks={
+            "on_part_begin": self._part_begin,
+            "on_header_field": self._header_field,
+            "on_header_value": self._header_value,
+            "on_header_end": self._header_end,
+            "on_part_data": self._part_data,
+            "on_part_end": self._part_end,
+        })
+
+    def feed(self, chunk: bytes):
+        if chunk and not (self.rejected or self._broken):
+            try:
+                self._parser.write(chunk)
+            except Exception:
+                # Malformed body - stop sniffing and let Starlette's parser report it
+                self._broken = True
+
+    def _part_begin(self):
+        self._is_file, self._head, self._checked = False, b"", False
+
+    def _header_field(self, data, start, end):
+        self._field += data[start:end]
+
+    def _header_value(self, data, start, end):
+        self._value += data[start:end]
+
+    def _header_end(self):
+        if self._field.lower() == b"content-disposition" and b"filename" in self._value:
+            self._is_file = True
+        self._field, self._value = b"", b""
+
+    def _part_data(self, data, start, end):
+        if self._is_file and not self._checked:
+            self._head += data[start:min(end, start + SNIFF_BYTES)]
+            if len(self._head) >= SNIFF_BYTES:
+                self._check()
+
+    def _part_end(self):
+        # Empty files are left to ingest_upload's 400
+        if self._is_file and not self._checked and self._head:
+            self._check()
+
+    def _check(self):
+        self._checked = True
+        if sniff_kind(self._head) not in self.allowed:
+            self.rejected = True
+
+
+class UploadSniffMiddleware:
+    """
+    Reject multipart uploads whose files are not an allowed type, mid-stream.
+
+    `path_kinds` maps a route to the file kinds it accepts. Each file
+    part's magic bytes are checked in the receive() chunk that carries
+    them, so a disguised 10MB upload gets its 415 after the first chunk
+    instead of after the whole body has been received and spooled.
+    """
+
+    def __init__(self, app, path_kinds: dict):
+        self.app = app
+        self.path_kinds = {path: set(kinds) for path, kinds in path_kinds.items()}
+
+    async def __call__(self, scope, receive, send):
+        allowed = self.path_kinds.get(scope.get("path")) if scope["type"] == "http" else None
+        content_type = dict(scope.get("headers", [])).get(b"content-type", b"") if allowed else b""
+        media_type, options = parse_options_header(content_type)
+        boundary = options.get(b"boundary")
+        if media_type != b"multipart/form-data" or not boundary:
+            await self.app(scope, receive, send)
+            return
+
+        sniffer = _PartSniffer(boundary, allowed)
+
+        async def sniffing_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                sniffer.feed(message.get("body", b""))
+                if sniffer.rejected:
+                    raise _RejectBody(
+                        status_code=415,
+                        detail=f"Unsupported file content. Expected one of: {', '.join(sorted(allowed))}."
+                    )
+            return message
+
+        await _run_guarded(self.app, scope, sniffing_receive, send)
@@ -0,0 +1,131 @@
+import math
+import re
+from difflib import SequenceMatcher
+from typing import Any, List
+
+from PIL import Image
+
+# ===============================
+# IMAGE TOKEN BUDGET
+# ===============================
+# Gemini bills an image as 258 tokens when both sides are <= 384px and
+# otherwise as 258 tokens per 768x768 tile.
+TOKENS_PER_TILE = 258
+TILE_SIZE = 768
+SMALL_IMAGE_SIDE = 384
+
+# Long side cap before sending; prescription text stays legible at this size
+MAX_IMAGE_SIDE = 2048
+
+# Per-call limits for packed requests
+VISION_TOKEN_BUDGET = 8000
+MAX_IMAGES_PER_CALL = 6
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    if width <= SMALL_IMAGE_SIDE and height <= SMALL_IMAGE_SIDE:
+        return TOKENS_PER_TILE
+    return math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE) * TOKENS_PER_TILE
+
+
+def fit_image(image: Image.Image, max_side: int = MAX_IMAGE_SIDE) -> Image.Image:
+    """Downscale so the long side is at most `max_side` (keeps aspect ratio)"""
+    if max(image.width, image.height) <= max_side:
+        return image
+    image = image.copy()
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+    return image
+
+
+def pack_pages(
+    pages: List[Any],
+    token_budget: int = VISION_TOKEN_BUDGET,
+    max_images: int = MAX_IMAGES_PER_CALL,
+) -> List[List[Any]]:
+    """
+    Group pages (anything with `width`/`height`) into as few calls as fit the budget.
+
+    Page order is preserved so a medicine split across consecutive photos
+    lands in the same call whenever the budget allows.
+    """
+    batches = []
+    current = []
+    used = 0
+    for page in pages:
+        cost = estimate_image_tokens(page.width, page.height)
+        if current and (used + cost > token_budget or len(current) >= max_images):
+            batches.append(current)
+            current = []
+            used = 0
+        current.append(page)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+# ===============================
+# CROSS-IMAGE MERGE
+# ===============================
+NAME_SIMILARITY = 0.9
+
+
+def medicine_key(name: str) -> str:
+    """'Paracetamol 500 mg' and 'PARACETAMOL 500mg.' share a key"""
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+def _words(name: str) -> str:
+    """Lowercase words separated by single spaces, punctuation dropped"""
+    return re.sub(r"[^a-z0-9]+", " ", name.lower()).strip()
+
+
+def _same_medicine(a: str, b: str) -> bool:
+    key_a, key_b = medicine_key(a), medicine_key(b)
+    if key_a == key_b:
+        return True
+    # Different strengths are different medicines ("250mg" vs "500mg")
+    strength_a, strength_b = re.findall(r"\d+", key_a), re.findall(r"\d+", key_b)
+    if strength_a and strength_b and strength_a != strength_b:
+        return False
+    # A name cut at a photo edge ("Amoxicil") stops mid-word in the full one.
+    # A prefix that ends on a word boundary names another product
+    # ("Vitamin" / "Vitamin D3", "Metoprolol" / "Metoprolol XL").
+    short, full = sorted((_words(a), _words(b)), key=len)
+    if full.startswith(short):
+        return len(medicine_key(short)) >= 5 and full[len(short)] != " "
+    # Otherwise only OCR noise matches: same words, a misread character or
+    # two, same length give or take one - "Prednisone" / "Prednisolone" differ
+    if len(short.split()) != len(full.split()) or abs(len(key_a) - len(key_b)) > 1:
+        return False
+    return SequenceMatcher(None, key_a, key_b).ratio() >= NAME_SIMILARITY
+
+
+def merge_medicines(medicines: List[dict]) -> List[dict]:
+    """
+    Deduplicate medicines extracted from several images of one prescription.
+
+    Duplicates are merged rather than dropped: intake and custom times are
+    unioned, the longer duration and the longer (more complete) name win,
+    and a medicine is critical if any copy says so.
+    """
+    merged: List[dict] = []
+
+    for med in medicines:
+        name = med.get("name", "")
+        if not medicine_key(name):
+            continue
+
+        for existing in merged:
+            if _same_medicine(name, existing["name"]):
+                existing["intakeTimes"] = list(dict.fromkeys(existing["intakeTimes"] + med.get("intakeTimes", [])))
+                existing["customTimes"] = list(dict.fromkeys(existing["customTimes"] + med.get("customTimes", [])))
+                existing["durationDays"] = max(existing.get("durationDays", 7), med.get("durationDays", 7))
+                existing["isCritical"] = existing.get("isCritical", False) or med.get("isCritical", False)
+                if len(name) > len(existing["name"]):
+                    existing["name"] = name
+                break
+        else:
+            merged.append(dict(med))
+
+    return merged